@@ -0,0 +1,121 @@
+from theworldfoundry.components import Named, Spatial, Wandering
+from theworldfoundry.modes import ActionMode
+
+from tests.utils import make_player
+
+
+def wanderer(zone, room, destinations, wanderlust):
+    cat = zone.spawn(
+        [
+            Named("a cat", "A wandering cat."),
+            Spatial(),
+            Wandering(
+                wanderlust=wanderlust, destination_ids=[d.id for d in destinations]
+            ),
+        ],
+        mode=ActionMode(),
+    )
+    room.Container.store(cat)
+    return cat
+
+
+def test_wander(zone, antechamber, courtyard):
+    cat = wanderer(zone, antechamber, [courtyard], wanderlust=1)
+    zone.perform_tick()
+    assert cat.Spatial.container == courtyard
+
+
+def test_stay(zone, antechamber, courtyard):
+    cat = wanderer(zone, antechamber, [courtyard], wanderlust=0)
+    zone.perform_tick()
+    assert cat.Spatial.container == antechamber
+
+
+def test_wander_only_to_destinations(zone, antechamber, courtyard):
+    cat = wanderer(zone, antechamber, [], wanderlust=1)
+    zone.perform_tick()
+    assert cat.Spatial.container == antechamber
+
+
+def test_wander_sampled(zone, antechamber, courtyard):
+    zone.sampled_ticks = True
+    cat = wanderer(zone, antechamber, [courtyard], wanderlust=1)
+    zone.perform_tick()
+    assert cat.Spatial.container == courtyard
+
+
+def test_wanderlust_changed_sampled(zone, antechamber, courtyard):
+    zone.sampled_ticks = True
+    cat = wanderer(zone, antechamber, [courtyard], wanderlust=0)
+    zone.perform_tick()
+    assert cat.Spatial.container == antechamber
+
+    cat.Wandering.wanderlust = 1
+    zone.perform_tick()
+    assert cat.Spatial.container == courtyard
+
+
+def test_dormant_room(zone, antechamber, courtyard):
+    zone.suspend_dormant = True
+    cat = wanderer(zone, antechamber, [courtyard], wanderlust=1)
+    zone.perform_tick()
+    assert cat.Spatial.container == antechamber
+
+    # Walking in catches the cat up on the ticks it slept through
+    antechamber.Container.store(make_player(zone))
+    assert cat.Spatial.container == courtyard
+
+    # ...and it goes back to sleep in the empty courtyard
+    zone.perform_tick()
+    assert cat.Spatial.container == courtyard
+
+
+def test_dormant_room_wakes_for_listener(zone, player, antechamber, courtyard):
+    zone.suspend_dormant = True
+    cat = wanderer(zone, courtyard, [antechamber], wanderlust=1)
+    assert cat.Wandering in zone.suspended
+    zone.perform_tick()
+
+    courtyard.Container.store(player)
+    assert cat.Spatial.container == antechamber
+    assert cat.Wandering in zone.suspended
+
+
+def test_dormant_room_when_listener_leaves(zone, player, antechamber, courtyard):
+    zone.suspend_dormant = True
+    cat = wanderer(zone, antechamber, [courtyard], wanderlust=1)
+    assert cat.Wandering not in zone.suspended
+
+    player.Spatial.unstore()
+    assert cat.Wandering in zone.suspended
+
+
+def test_dormant_room_when_listener_destroyed(zone, player, antechamber, courtyard):
+    zone.suspend_dormant = True
+    cat = wanderer(zone, antechamber, [courtyard], wanderlust=1)
+
+    zone.destroy(player)
+    assert player not in antechamber.Container.contents
+    assert cat.Wandering in zone.suspended
+
+
+def test_dormant_room_when_hearing_changes(zone, player, antechamber, courtyard):
+    zone.suspend_dormant = True
+    cat = wanderer(zone, antechamber, [courtyard], wanderlust=1)
+
+    player.hearing = False
+    assert cat.Wandering in zone.suspended
+
+    player.hearing = True
+    assert cat.Wandering not in zone.suspended
+
+
+def test_dormant_room_stays_dormant(zone, antechamber, courtyard):
+    zone.suspend_dormant = True
+    cat = zone.spawn([Named("a cat", "A sleepy cat."), Spatial()], mode=ActionMode())
+    antechamber.Container.store(cat)
+
+    # Taking up wandering in an empty room doesn't wake it
+    cat.components.add(Wandering(wanderlust=1, destination_ids=[courtyard.id]))
+    zone.perform_tick()
+    assert cat.Spatial.container == antechamber
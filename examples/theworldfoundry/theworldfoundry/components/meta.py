@@ -253,6 +253,7 @@ def add_alias(actor, alias, entity_id):
         return
 
     actor.Admin.aliases[alias] = entity_id
+    actor.Admin.touch()
 
 
 @ActionMode.action(r"^!a(?:lias)? (rm|remove|del(ete)?|unset) (?P<alias>.+)$")
@@ -262,6 +263,7 @@ def remove_alias(actor, alias):
         return
 
     actor.Admin.aliases.pop(alias, None)
+    actor.Admin.touch()
 
 
 @ActionMode.action(r"^!a(?:lias)?(?: list)?$")
@@ -106,12 +106,18 @@ class Container(Component):
         if quantity is not None and entity.is_(Stackable):
             entity = entity.Stackable.split_off(quantity)
 
-        entity.Spatial.unstore()
+        old_room = entity.Spatial.room
+
+        entity.Spatial.leave_container()
         container.Container.contents_ids.add(entity.id)
         container.Container.contents.add(entity)
+        container.Container.touch()
         entity.Spatial.container_id = container.id
         entity.Spatial.container = container
 
+        if entity.zone.suspend_dormant:
+            update_dormancy(entity, old_room)
+
         return entity
 
     def consolidate_contents(self):
@@ -137,6 +143,42 @@ class Container(Component):
             listener.tell(message)
 
 
+def subtree(entity):
+    """Return an entity along with everything nested inside of it."""
+    entities = [entity]
+    for entity in entities:
+        if entity.is_(Container):
+            entities.extend(entity.Container.contents)
+    return entities
+
+
+def set_dormant(entities, dormant):
+    for entity in entities:
+        entity.zone.set_dormant(entity, dormant)
+
+
+def settle(room):
+    """Suspend ticking in a room nobody can hear, or resume it if someone can."""
+    entities = subtree(room)
+    set_dormant(entities, not any(entity.hearing for entity in entities))
+
+
+def update_dormancy(entity, old_room):
+    """
+    Bring a moved entity in line with its new room. If it brought a listener
+    with it from another room, that room may have gone dormant and this one
+    may have woken up.
+    """
+    moved = subtree(entity)
+    room = entity.Spatial.room
+
+    if room is not old_room and any(e.hearing for e in moved):
+        settle(old_room)
+        settle(room)
+    else:
+        set_dormant(moved, not any(e.hearing for e in subtree(room)))
+
+
 class Exitable(Component):
     def __init__(self):
         self.exit_ids = set()
@@ -199,21 +241,44 @@ class Spatial(Component):
         self.container = entity.zone.get(self.container_id)
 
     def detach(self):
-        self.container = None
+        # Whatever is detaching it (usually being destroyed) takes it out of
+        # the room, so the room may have lost its last listener
+        self.unstore()
         super(Spatial, self).detach()
 
+    def hearing_changed(self):
+        if self.entity.zone.suspend_dormant:
+            settle(self.room)
+
     def store_in(self, entity):
         Container.move(self.entity, entity)
 
     def unstore(self):
+        old_room = self.room
+        self.leave_container()
+
+        if old_room is not self.entity and self.entity.zone.suspend_dormant:
+            update_dormancy(self.entity, old_room)
+
+    def leave_container(self):
+        """Take this entity out of its container without settling any rooms."""
         container = self.container
         if container:
             container.Container.contents_ids.remove(self.entity.id)
             container.Container.contents.remove(self.entity)
+            container.Container.touch()
 
         self.container = None
         self.container_id = None
 
+    @property
+    def room(self):
+        """The outermost container this entity is inside of, or itself."""
+        room = self.entity
+        while room.is_(Spatial) and room.Spatial.container is not None:
+            room = room.Spatial.container
+        return room
+
     #########################
     # Selection
     #########################
@@ -4,9 +4,15 @@ from figment import Component
 
 from theworldfoundry.components import spatial
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 class Wandering(Component):
     ticking = True
+    sheddable = True
 
     def __init__(self, wanderlust=0.01, destination_ids=[]):
         self.wanderlust = wanderlust
@@ -24,10 +30,31 @@ class Wandering(Component):
         self.destinations = []
         super(Wandering, self).detach()
 
-    def tick(self):
-        if random.random() >= self.wanderlust:
-            return
+    @property
+    def tick_chance(self):
+        return self.wanderlust
+
+    def act(self, dt):
+        self.wander()
+
+    @classmethod
+    def tick_batch(cls, components, dt):
+        # Nearly every wanderer stays put on any given tick, so roll for all of
+        # them at once and only visit the few that move
+        if numpy is not None:
+            rolls = numpy.random.random(len(components))
+            chances = numpy.fromiter(
+                (c.tick_chance for c in components), float, len(components)
+            )
+            wanderers = [components[i] for i in numpy.flatnonzero(rolls < chances)]
+        else:
+            wanderers = [c for c in components if random.random() < c.tick_chance]
+
+        for component in wanderers:
+            if component.entity is not None:
+                component.act(dt)
 
+    def wander(self):
         if not self.entity.is_(spatial.Spatial):
             return
 
@@ -44,5 +71,5 @@ class Wandering(Component):
         if not valid_exits:
             return
 
-        direction = random.choice(list(valid_exits))
+        exit = random.choice(list(valid_exits))
         self.entity.perform(spatial.walk, direction=exit.Exit.direction)
@@ -40,7 +40,7 @@ class DisambiguationMode(Mode):
 
         action = ActionMode.ACTIONS_BY_NAME[self.action_name]
         self.kwargs[self.argument_name] = self.choices[command_or_index - 1]
-        action(entity, **self.kwargs)
+        entity.zone.perform_action(action, entity, **self.kwargs)
 
 
 class ActionMode(Mode):
@@ -79,4 +79,5 @@ class ActionMode(Mode):
             entity.tell("Unknown command.")
             return
 
-        action(entity, **kwargs)
+        # Actions may be generators that pause between ticks
+        entity.zone.perform_action(action, entity, **kwargs)
@@ -0,0 +1,77 @@
+"""
+Long-running actions that pause between ticks instead of blocking the zone.
+
+An action run through `Zone.perform_action` can be a generator. Each time it
+yields, the zone puts it aside and goes on processing other events:
+
+    def countdown(actor, count):
+        while count:
+            actor.tell(str(count))
+            count -= 1
+            yield Wait(1, count=count)
+        actor.tell("Liftoff!")
+
+`yield Wait(n)` resumes the action after n ticks, and a bare `yield` resumes it
+as soon as the zone has worked through the events that are already waiting.
+
+A generator can't be saved, so snapshots only record which function was
+running, for which entity, and with what arguments. Any keyword arguments
+given to Wait replace the action's original ones, and if the zone restarts in
+the meantime the action is started over with them once its wait is up. An
+action that needs to survive restarts should pass along whatever it needs
+to pick up where it left off, as `countdown` does with `count`.
+"""
+
+import inspect
+
+from figment.timers import callback_to_dict, callback_from_dict
+
+
+class Wait:
+    def __init__(self, ticks=1, **kwargs):
+        self.ticks = ticks
+        self.kwargs = kwargs
+
+
+class Action:
+    def __init__(self, function, entity, kwargs, generator=None):
+        self.function = function
+        self.entity = entity
+        self.kwargs = dict(kwargs)
+        self.generator = generator
+
+    def to_dict(self):
+        return {
+            "function": callback_to_dict(self.function),
+            "entity_id": self.entity.id,
+            "kwargs": self.kwargs,
+        }
+
+    @classmethod
+    def from_dict(cls, dict_, zone):
+        """Restore a saved action, or return None if it can't be resumed."""
+        entity = zone.get(dict_["entity_id"])
+        function = callback_from_dict(dict_["function"], zone)
+        if entity is None or function is None:
+            return None
+        return cls(function, entity, dict_["kwargs"])
+
+    def step(self):
+        """
+        Run the action until it next yields, returning how many ticks it wants
+        to wait (0 to resume as soon as possible), or None once it's finished.
+        """
+        if self.generator is None:
+            self.generator = self.function(self.entity, **self.kwargs)
+            if not inspect.isgenerator(self.generator):
+                return None
+
+        try:
+            yielded = next(self.generator)
+        except StopIteration:
+            return None
+
+        if isinstance(yielded, Wait):
+            self.kwargs.update(yielded.kwargs)
+            return max(0, yielded.ticks)
+        return 0
@@ -0,0 +1,426 @@
+"""
+An asyncio-driven zone. Commands and ticks are still processed one at a time,
+in order, by a single task; transport I/O, the tick timer, and housekeeping run
+as separate tasks on the same event loop so they can overlap with processing.
+"""
+
+import asyncio
+import traceback
+from time import time
+
+from redis.asyncio import Redis as AsyncRedis
+
+from figment.logger import log
+from figment.ticker import TickClock
+from figment.transport import DRAIN_SCRIPT, TICK, Event, TransportError
+from figment.zone import Zone, fatal
+
+
+class AsyncTransport:
+    """The awaitable subset of Transport that an AsyncZone needs."""
+
+    # How long a receive waits for events before giving up, so the receiving
+    # task gets to notice the zone stopping. Cancelling a receive instead
+    # could lose whatever it had already taken off the queue.
+    poll_interval = 1
+
+    async def push_tick(self, payload):
+        raise NotImplementedError
+
+    async def clear_ticks(self):
+        raise NotImplementedError
+
+    async def backlog(self):
+        return None
+
+    async def receive(self, count=1):
+        """
+        Wait up to `poll_interval` seconds for an event, then take up to
+        `count` of them, returning an empty list if none arrived.
+        """
+        raise NotImplementedError
+
+    async def requeue(self, events):
+        raise NotImplementedError
+
+    async def drain_ticks(self):
+        raise NotImplementedError
+
+    async def publish(self, messages):
+        raise NotImplementedError
+
+    async def ack(self, events):
+        pass
+
+    async def close(self):
+        pass
+
+
+class AsyncRedisTransport(AsyncTransport):
+    def __init__(self, transport):
+        self.transport = transport
+        self.redis = AsyncRedis(host=transport.host, port=transport.port)
+        self.drain_script = self.redis.register_script(DRAIN_SCRIPT)
+
+    async def push_tick(self, payload):
+        await self.redis.rpush(self.transport.tick_key, payload)
+
+    async def clear_ticks(self):
+        await self.redis.ltrim(self.transport.tick_key, 0, 0)
+
+    async def backlog(self):
+        return await self.redis.llen(self.transport.incoming_key)
+
+    async def receive(self, count=1):
+        keys = [self.transport.tick_key, self.transport.incoming_key]
+        event = await self.redis.blpop(keys, timeout=self.poll_interval)
+        if event is None:
+            return []
+        events = [event]
+
+        if count > 1:
+            drained = await self.drain_script(keys=keys, args=[count - 1])
+            events.extend(zip(drained[::2], drained[1::2]))
+
+        return [self.transport.decode(key, value) for key, value in events]
+
+    async def requeue(self, events):
+        pipeline = self.redis.pipeline()
+        for kind, value in reversed(events):
+            pipeline.lpush(self.transport.key_for(kind), value)
+        await pipeline.execute()
+
+    async def drain_ticks(self):
+        pipeline = self.redis.pipeline()
+        pipeline.lrange(self.transport.tick_key, 0, -1)
+        pipeline.delete(self.transport.tick_key)
+        values, _ = await pipeline.execute()
+        return [Event(TICK, value.decode("utf-8")) for value in values]
+
+    async def publish(self, messages):
+        pipeline = self.redis.pipeline(transaction=False)
+        for entity_id, message in messages:
+            pipeline.publish(self.transport.messages_key(entity_id), message)
+        await pipeline.execute()
+
+    async def close(self):
+        await self.redis.close()
+
+
+class AsyncRedisStreamsTransport(AsyncRedisTransport):
+    """Awaitable counterpart of RedisStreamsTransport, sharing its state."""
+
+    async def push_tick(self, payload):
+        await self.redis.xadd(
+            self.transport.tick_key,
+            {"data": payload},
+            maxlen=self.transport.tick_maxlen,
+            approximate=True,
+        )
+
+    async def clear_ticks(self):
+        await self.ensure_groups()
+        await self.redis.xgroup_setid(
+            self.transport.tick_key, self.transport.group, "$"
+        )
+
+    async def backlog(self):
+        pipeline = self.redis.pipeline(transaction=False)
+        pipeline.xlen(self.transport.incoming_key)
+        pipeline.time()
+        before = time()
+        length, server_time = await pipeline.execute()
+        self.transport.set_clock(server_time, before, time())
+        return length
+
+    async def ensure_groups(self):
+        if self.transport.groups_created:
+            return
+        await asyncio.get_running_loop().run_in_executor(
+            None, self.transport.ensure_groups
+        )
+
+    async def receive(self, count=1):
+        transport = self.transport
+        await self.ensure_groups()
+
+        while not transport.buffer:
+            replaying = transport.replaying
+            events, deleted = transport.parse(
+                await self.redis.xreadgroup(
+                    **transport.read_args(count, self.poll_interval)
+                )
+            )
+            if deleted:
+                await self.acknowledge(deleted)
+            transport.buffer.extend(events)
+            if not events and not replaying:
+                break
+
+        events = []
+        while transport.buffer and len(events) < count:
+            events.append(transport.buffer.popleft())
+        return events
+
+    async def requeue(self, events):
+        self.transport.requeue(events)
+
+    async def drain_ticks(self):
+        transport = self.transport
+        if transport.replaying:
+            return transport.drain_buffered_ticks()
+
+        events, _ = transport.parse(
+            await self.redis.xreadgroup(**transport.drain_args())
+        )
+        return transport.drain_buffered_ticks() + events
+
+    async def ack(self, events):
+        await self.acknowledge([event.id for event in events])
+
+    async def acknowledge(self, ids):
+        if not ids:
+            return
+
+        ids_by_key = {}
+        for key, entry_id in ids:
+            ids_by_key.setdefault(key, []).append(entry_id)
+
+        pipeline = self.redis.pipeline(transaction=False)
+        for key, entry_ids in ids_by_key.items():
+            pipeline.xack(key, self.transport.group, *entry_ids)
+            pipeline.xdel(key, *entry_ids)
+        await pipeline.execute()
+
+
+class ThreadedAsyncTransport(AsyncTransport):
+    """
+    Adapts a synchronous transport by running its blocking calls in the event
+    loop's default executor.
+    """
+
+    def __init__(self, transport):
+        self.transport = transport
+
+    async def call(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    async def push_tick(self, payload):
+        await self.call(self.transport.push_tick, payload)
+
+    async def clear_ticks(self):
+        await self.call(self.transport.clear_ticks)
+
+    async def backlog(self):
+        return await self.call(self.transport.backlog)
+
+    async def receive(self, count=1):
+        return await self.call(self.transport.receive, count, self.poll_interval)
+
+    async def requeue(self, events):
+        await self.call(self.transport.requeue, events)
+
+    async def drain_ticks(self):
+        return await self.call(self.transport.drain_ticks)
+
+    async def publish(self, messages):
+        await self.call(self.transport.publish, messages)
+
+    async def ack(self, events):
+        await self.call(self.transport.ack, events)
+
+
+class AsyncZone(Zone):
+    def __init__(self):
+        super(AsyncZone, self).__init__()
+        self.atransport = None
+        self.inbound = None
+        self.outbound = None
+        self.leftover = []
+        # Fetched ahead of each housekeeping, which can't wait on the transport
+        self._backlog = None
+
+    def load_config(self):
+        super(AsyncZone, self).load_config()
+        self.atransport = self.transport.aio()
+
+    def start(self):
+        try:
+            self.transport.ping()
+        except TransportError as e:
+            fatal(str(e))
+
+        try:
+            asyncio.run(self.run())
+        except Exception:
+            log.critical(traceback.format_exc())
+        except BaseException:
+            pass
+        finally:
+            self.save_snapshot()
+            self.reap_snapshot(block=True)
+
+    async def run(self):
+        self.running = True
+        log.info("Listening (async).")
+
+        # Clear any existing tick events
+        await self.atransport.clear_ticks()
+
+        if self.watchdog is not None:
+            self.watchdog.start()
+
+        # One batch is prefetched while another is processed, so up to two
+        # batches are out of the transport at once. Both are requeued on
+        # shutdown, but with list transports a crash loses them.
+        self.inbound = asyncio.Queue(maxsize=1)
+        self.outbound = asyncio.Queue()
+
+        receiver = asyncio.ensure_future(self.receive_loop())
+        publisher = asyncio.ensure_future(self.publish_loop())
+        tasks = [receiver, publisher] + [
+            asyncio.ensure_future(coroutine)
+            for coroutine in (self.tick_loop(), self.housekeeping_loop())
+        ]
+
+        try:
+            await self.process_loop(tasks)
+        finally:
+            self.running = False
+            # The receive and publish loops would lose the events or messages
+            # they're holding if they were cancelled, so they're left to
+            # finish instead
+            for task in tasks[2:]:
+                task.cancel()
+            self.outbound.put_nowait(None)
+            prefetched = await self.stop_receiving(receiver)
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self.drain_outbound()
+            await self.requeue_unprocessed(prefetched)
+            await self.atransport.close()
+            if self.watchdog is not None:
+                self.watchdog.stop()
+
+    async def process_loop(self, tasks):
+        while self.running:
+            # Events cut off by batch_time run before anything prefetched
+            # since, so ordering is the same as in the synchronous loop
+            if self.leftover:
+                events, self.leftover = self.leftover, []
+            else:
+                events = await self.next_batch(tasks, self.receive_timeout())
+                if not events and self.pending_phases:
+                    self.run_phase()
+                if self.command_queue is not None:
+                    events, dropped = self.take_commands(events)
+                    await self.atransport.ack(dropped)
+
+            leftover = self.process_events(events)
+            self.leftover = self.return_commands(leftover)
+            await self.atransport.ack(events[: len(events) - len(leftover)])
+            self.run_ready_actions()
+
+    async def next_batch(self, tasks, timeout=None):
+        inbound = asyncio.ensure_future(self.inbound.get())
+        done, _ = await asyncio.wait(
+            tasks + [inbound], timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+        )
+
+        # A batch that came in alongside anything else still gets processed
+        if inbound in done:
+            return inbound.result()
+        inbound.cancel()
+
+        # A helper task should only finish if it crashed, or if the receive
+        # loop has seen the zone stopping
+        for task in tasks:
+            if task in done:
+                task.result()
+                if self.running:
+                    raise RuntimeError("Zone task exited unexpectedly")
+
+        return []
+
+    async def stop_receiving(self, receiver):
+        """
+        Wait for the receive loop to see that the zone has stopped, taking
+        whatever batches it hands over meanwhile. Returns those batches.
+        """
+        batches = []
+        while not receiver.done():
+            batch = asyncio.ensure_future(self.inbound.get())
+            await asyncio.wait([receiver, batch], return_when=asyncio.FIRST_COMPLETED)
+            if not batch.cancel():
+                batches.extend(batch.result())
+        return batches
+
+    async def requeue_unprocessed(self, prefetched=()):
+        unprocessed = self.leftover
+        if self.command_queue is not None:
+            unprocessed.extend(self.command_queue.drain())
+        while not self.inbound.empty():
+            unprocessed.extend(self.inbound.get_nowait())
+        unprocessed.extend(prefetched)
+        self.leftover = []
+
+        if unprocessed:
+            await self.atransport.requeue(unprocessed)
+
+    async def receive_loop(self):
+        while self.running:
+            count = self.receive_count()
+            if count:
+                events = await self.atransport.receive(count)
+            else:
+                # The fair command queue is full, so only ticks are taken
+                events = await self.atransport.drain_ticks()
+                if not events:
+                    await asyncio.sleep(self.tick_interval)
+            if not events:
+                continue
+
+            if self.coalesce_ticks and any(kind == TICK for kind, _ in events):
+                events, absorbed = self.merge_tick_events(
+                    events + await self.atransport.drain_ticks()
+                )
+                await self.atransport.ack(absorbed)
+
+            await self.inbound.put(events)
+
+    def publish(self, messages):
+        # Messages go out from the publish loop, off the processing task
+        if self.outbound is None:
+            super(AsyncZone, self).publish(messages)
+        else:
+            self.outbound.put_nowait(messages)
+
+    def backlog(self):
+        return self._backlog
+
+    async def publish_loop(self):
+        while True:
+            outbox = await self.outbound.get()
+            if outbox is None:
+                return
+            await self.atransport.publish(outbox)
+
+    async def drain_outbound(self):
+        # Anything the publish loop didn't get to before it stopped
+        while not self.outbound.empty():
+            outbox = self.outbound.get_nowait()
+            if outbox is not None:
+                await self.atransport.publish(outbox)
+
+    async def tick_loop(self):
+        log.info("Ticking every %ss." % self.tick_interval)
+        clock = TickClock(self.tick_interval)
+        while True:
+            await asyncio.sleep(clock.delay())
+            await self.atransport.push_tick(clock.next_tick())
+
+    async def housekeeping_loop(self):
+        while True:
+            await asyncio.sleep(self.housekeeping_interval)
+            if self.overload is not None:
+                self._backlog = await self.atransport.backlog()
+            self.housekeeping()
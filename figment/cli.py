@@ -3,9 +3,10 @@ import json
 import readline
 import logging
 import os
-from time import sleep
+import tempfile
 import threading
 import sys
+from time import perf_counter
 
 from figment.zone import Zone
 from figment.logger import log
@@ -14,6 +15,10 @@ PROMPT = "\033[32;1m> "
 RESET = "\033[m"
 ERASE_DOWN = "\033[J"
 
+# How long the listener blocks waiting for a message before checking whether
+# the prompt has quit; messages themselves are delivered as soon as they arrive
+QUIT_CHECK_INTERVAL = 0.5
+
 prompt_quit = False
 
 
@@ -46,14 +51,16 @@ def listen(args):
 
     while True:
         if prompt_quit:
+            subscription.close()
             break
 
-        message = subscription.get_message()
-        if not message:
-            sleep(0.01)
+        message = subscription.get_message(timeout=QUIT_CHECK_INTERVAL)
+        if message is None:
             continue
 
-        rendered_message = renderer.render(json.loads(message["data"]))
+        rendered_message = "\n".join(
+            renderer.render(m) for m in zone.unmerge(json.loads(message))
+        )
 
         sys.stdout.write(
             "".join(
@@ -72,6 +79,10 @@ def listen(args):
 
 
 def client(args):
+    if Zone.from_config(args.zone, args.world).transport.in_process:
+        log.critical("This world's transport can't be reached from another process")
+        sys.exit(1)
+
     prompt_thread = threading.Thread(target=lambda: prompt(args))
     listen_thread = threading.Thread(target=lambda: listen(args))
 
@@ -96,7 +107,12 @@ def run(args):
         log.setLevel(logging.DEBUG)
 
     try:
-        zone = Zone.from_config(args.zone, args.world)
+        if args.use_async and not args.ticker:
+            from figment.aio import AsyncZone
+
+            zone = AsyncZone.from_config(args.zone, args.world)
+        else:
+            zone = Zone.from_config(args.zone, args.world)
 
         if args.ticker:
             zone.start_ticker()
@@ -118,6 +134,60 @@ def run(args):
             raise
 
 
+def bench_snapshots(args):
+    """Time saving and loading a synthetic world in each snapshot format."""
+    from figment import snapshots
+    from figment.serializers import SNAPSHOT_SERIALIZERS
+
+    def entities():
+        for id in range(1, args.entities + 1):
+            yield {
+                "id": id,
+                "mode": None,
+                "hearing": False,
+                "components": {
+                    "Named": {"name": "thing %s" % id, "desc": "A thing. " * 5},
+                    "Spatial": {"container_id": id // 100 + 1},
+                    "Container": {"contents_ids": list(range(id, id + 5))},
+                },
+            }
+
+    header = {"generation": 1, "timers": [], "actions": []}
+    # YAML takes minutes on a world of any size, so it has to be asked for
+    formats = args.formats or sorted(
+        name for name in SNAPSHOT_SERIALIZERS if name != "yaml"
+    )
+
+    print("%-6s %10s %10s %12s" % ("format", "save (s)", "load (s)", "size (bytes)"))
+    with tempfile.TemporaryDirectory() as directory:
+        for name in formats:
+            serializer = SNAPSHOT_SERIALIZERS[name]
+            path = os.path.join(directory, "snapshot.%s" % name)
+
+            try:
+                started = perf_counter()
+                snapshots.write(
+                    path,
+                    serializer,
+                    dict(header, entities=entities()),
+                    args.compression,
+                )
+                saved = perf_counter()
+                with snapshots.reading(path) as f:
+                    _, loaded = serializer.load_snapshot(f)
+                    for _ in loaded:
+                        pass
+                finished = perf_counter()
+            except ImportError as e:
+                print("%-6s skipped (%s)" % (name, e))
+                continue
+
+            print(
+                "%-6s %10.3f %10.3f %12s"
+                % (name, saved - started, finished - saved, os.path.getsize(path))
+            )
+
+
 def cli():
     parser = argparse.ArgumentParser(description="Manipulates a Figment world.")
 
@@ -152,6 +222,31 @@ def cli():
         "-v", "--verbose", action="store_true", help="show verbose output"
     ).arg("-d", "--debug", action="store_true", help="run pdb if Figment crashes").arg(
         "-t", "--ticker", action="store_true", help="run as a tick event generator"
+    ).arg(
+        "--async",
+        dest="use_async",
+        action="store_true",
+        help="run the zone on an asyncio event loop with a built-in ticker",
+    )
+
+    cmd(
+        "bench-snapshots",
+        bench_snapshots,
+        help="compare snapshot formats on a synthetic world",
+    ).arg(
+        "-n",
+        "--entities",
+        type=int,
+        default=20000,
+        help="number of entities in the world",
+    ).arg(
+        "-f",
+        "--format",
+        dest="formats",
+        action="append",
+        help="snapshot format to include (default: all but yaml)",
+    ).arg(
+        "-c", "--compression", help="compress snapshots with zlib, gzip or lzma"
     )
 
     if len(sys.argv) == 1:
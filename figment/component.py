@@ -1,9 +1,44 @@
+import random
+
+
 class Component:
     ticking = False
 
+    # The probability that a ticking component does anything on a given tick.
+    # Components that set it implement `act` instead of `tick`, which lets a
+    # zone with sampled ticks wake them only on the ticks where they act. It
+    # can be a property, and it can change at any time; assigning to any
+    # attribute redraws the component's next turn if the chance has changed.
+    tick_chance = None
+
+    # How many zone ticks pass between this class's ticks. It applies to the
+    # whole class, and dt covers all of the ticks in between.
+    tick_every = 1
+
+    # Whether this class's ticks can be skipped while the zone is overloaded
+    sheddable = False
+
     def __init__(self):
         self.entity = None
 
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        self.touch()
+
+        entity = self.__dict__.get("entity")
+        if entity is not None and entity.zone is not None:
+            entity.zone.resample(self)
+
+    def touch(self):
+        """
+        Mark this component's entity as changed, so the next incremental
+        snapshot saves it. Assigning to an attribute does this automatically,
+        but changing a value in place (like adding to a set) doesn't.
+        """
+        entity = self.__dict__.get("entity")
+        if entity is not None and entity.zone is not None:
+            entity.zone.mark_dirty(entity)
+
     def to_dict(self):
         return {}
 
@@ -17,5 +52,49 @@ class Component:
     def detach(self):
         self.entity = None
 
-    def tick(self):
+    def hearing_changed(self):
+        """Called when the entity's `hearing` is switched on or off."""
         return
+
+    def schedule_in(self, delay, method, *args):
+        """Call one of this component's methods after `delay` seconds."""
+        if isinstance(method, str):
+            method = getattr(self, method)
+        return self.entity.zone.schedule(delay, method, *args)
+
+    def tick(self, dt):
+        """Called every tick; `dt` is the seconds elapsed since the last one."""
+        if self.tick_chance is not None and random.random() < self.tick_chance:
+            self.act(dt)
+
+    def act(self, dt):
+        """Called on the ticks where a component with a `tick_chance` acts."""
+        return
+
+    def catch_up(self, dt):
+        """
+        Called once when a suspended component is resumed, with the seconds
+        it spent suspended, in place of all the ticks it missed.
+        """
+        if self.tick_chance is None:
+            self.tick(dt)
+            return
+
+        # Act if it would have acted on any of the missed ticks (or periods,
+        # for a class that ticks less often than the zone)
+        period = self.entity.zone.tick_interval * max(1, self.tick_every)
+        periods = max(1, round(dt / period))
+        if random.random() < 1 - (1 - self.tick_chance) ** periods:
+            self.act(dt)
+
+    @classmethod
+    def tick_batch(cls, components, dt):
+        """
+        Called once per tick with every live, ticking instance of this class.
+        Override it to handle all of them at once; by default it just calls
+        each one's tick. A tick can detach later components in the batch, so
+        skip any whose entity is gone.
+        """
+        for component in components:
+            if component.ticking and component.entity is not None:
+                component.tick(dt)
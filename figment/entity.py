@@ -10,23 +10,32 @@ class ComponentStore:
         self.entity = entity
         self.components = {}
 
-    def add(self, components):
+    def add(self, components, attach=True):
+        """
+        Add components to the entity. With `attach` unset, they aren't
+        attached until attach() is called (see Zone.load_snapshot).
+        """
         if not isinstance(components, collections.abc.Iterable):
             components = [components]
 
         for component in components:
             component_name = component.__class__.__name__
+
+            replaced = self.components.get(component_name)
+            if replaced is not None and self.entity.zone:
+                self.entity.zone.untrack_ticking(replaced)
+
             setattr(self.entity, component_name, component)
-            component.attach(self.entity)
+            if attach:
+                component.attach(self.entity)
             self.components[component_name] = component
 
             if self.entity.zone:
                 self.entity.zone.entities_by_component_name.setdefault(
                     component_name, set()
                 ).add(self.entity)
-
-        if self.entity.zone and self.entity.ticking:
-            self.entity.zone.ticking_entities.add(self.entity)
+                self.entity.zone.track_ticking(component)
+                self.entity.zone.mark_dirty(self.entity)
 
     def remove(self, component_names):
         if isinstance(component_names, str) or not isinstance(
@@ -37,7 +46,8 @@ class ComponentStore:
         for component_name in component_names:
             if inspect.isclass(component_name):
                 component_name = component_name.__name__
-            getattr(self.entity, component_name).detach()
+            component = getattr(self.entity, component_name)
+            component.detach()
             delattr(self.entity, component_name)
             self.components.pop(component_name, None)
 
@@ -45,13 +55,12 @@ class ComponentStore:
                 self.entity.zone.entities_by_component_name[component_name].remove(
                     self.entity
                 )
+                self.entity.zone.untrack_ticking(component)
+                self.entity.zone.mark_dirty(self.entity)
 
-        if (
-            self.entity.zone
-            and self.entity in self.entity.zone.ticking_entities
-            and not self.entity.ticking
-        ):
-            self.entity.zone.ticking_entities.remove(self.entity)
+    def attach(self):
+        for component in self.components.values():
+            component.attach(self.entity)
 
     def has(self, component_names):
         if isinstance(component_names, str) or not isinstance(
@@ -81,6 +90,17 @@ class Entity:
         self.zone = zone
         self.hearing = hearing
 
+    def __setattr__(self, name, value):
+        changed = name == "hearing" and self.__dict__.get(name) != value
+        object.__setattr__(self, name, value)
+        if name in ("mode", "hearing"):
+            zone = self.__dict__.get("zone")
+            if zone is not None:
+                zone.mark_dirty(self)
+                if changed:
+                    for component in list(self.components):
+                        component.hearing_changed()
+
     def __eq__(self, other):
         if isinstance(other, Entity):
             return self.id == other.id
@@ -114,13 +134,13 @@ class Entity:
         }
 
     @classmethod
-    def from_dict(cls, dict_, zone):
+    def from_dict(cls, dict_, zone, attach=True):
         entity = cls(id=dict_["id"], hearing=dict_["hearing"])
         zone.add(entity)
-        entity.attach_from_dict(dict_)
+        entity.attach_from_dict(dict_, attach)
         return entity
 
-    def attach_from_dict(self, dict_):
+    def attach_from_dict(self, dict_, attach=True):
         mode_dict = dict_.get("mode", {})
         if mode_dict:
             mode_name = mode_dict.pop("__class__")
@@ -133,7 +153,7 @@ class Entity:
             component = self.zone.components[component_name].from_dict(component_dict)
             components.append(component)
 
-        self.components.add(components)
+        self.components.add(components, attach)
 
     def is_(self, *args, **kwargs):
         return self.components.has(*args, **kwargs)
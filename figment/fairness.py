@@ -0,0 +1,99 @@
+"""
+Serves queued commands fairly between entities.
+
+Commands arrive on a single queue, but the zone holds them in a queue per
+entity and takes them round-robin, so one entity sending a flood of commands
+only delays its own. Each entity's queue can be bounded, and each entity can be
+limited to a steady rate of commands (with some allowance for bursts) using a
+token bucket.
+
+Fairness only extends to the commands the zone has received, so it reads ahead
+of what it processes, holding up to `window` commands at a time.
+"""
+
+import collections
+from time import monotonic
+
+
+class FairQueue:
+    def __init__(self, window=256, queue_limit=None, rate=None, burst=None):
+        self.window = window
+        self.queue_limit = queue_limit
+        self.rate = rate
+        self.burst = burst or rate or 1
+        self.queues = collections.OrderedDict()
+        self.count = 0
+        # entity_id -> (tokens, monotonic time they were counted at)
+        self.tokens = {}
+
+    def __len__(self):
+        return self.count
+
+    def push(self, entity_id, event):
+        """Queue an event, returning False if the entity's queue is full."""
+        queue = self.queues.get(entity_id, ())
+        if self.queue_limit is not None and len(queue) >= self.queue_limit:
+            return False
+        self.queues.setdefault(entity_id, collections.deque()).append(event)
+        self.count += 1
+        return True
+
+    def requeue(self, entity_id, event):
+        """Put back an event that was taken but not processed."""
+        self.queues.setdefault(entity_id, collections.deque()).appendleft(event)
+        self.count += 1
+        self.queues.move_to_end(entity_id, last=False)
+        if self.rate is not None:
+            tokens, counted_at = self.tokens[entity_id]
+            self.tokens[entity_id] = (tokens + 1, counted_at)
+
+    def available(self, entity_id, now):
+        if self.rate is None:
+            return self.burst
+        tokens, counted_at = self.tokens.get(entity_id, (self.burst, now))
+        return min(self.burst, tokens + (now - counted_at) * self.rate)
+
+    def pop(self, now=None):
+        """Take the next event, or return None if no entity may send one yet."""
+        if now is None:
+            now = monotonic()
+
+        for entity_id, queue in self.queues.items():
+            tokens = self.available(entity_id, now)
+            if tokens < 1:
+                continue
+
+            if self.rate is not None:
+                self.tokens[entity_id] = (tokens - 1, now)
+
+            event = queue.popleft()
+            self.count -= 1
+            if queue:
+                self.queues.move_to_end(entity_id)
+            else:
+                del self.queues[entity_id]
+            return event
+
+        return None
+
+    def wait_time(self, now=None):
+        """
+        Return how long until some queued event may be taken (0 if one can be
+        right away), or None if nothing is queued.
+        """
+        if not self.queues:
+            return None
+        if self.rate is None:
+            return 0
+
+        if now is None:
+            now = monotonic()
+        needed = min(1 - self.available(entity_id, now) for entity_id in self.queues)
+        return max(0, needed / self.rate)
+
+    def drain(self):
+        """Take every queued event, regardless of fairness or rate limits."""
+        events = [event for queue in self.queues.values() for event in queue]
+        self.queues.clear()
+        self.count = 0
+        return events
@@ -0,0 +1,109 @@
+"""
+An append-only log of everything a zone does between snapshots.
+
+Each record is one line of JSON: a sequence number, a kind, whatever that kind
+needs to be replayed, and the seed the zone's random number generator was given
+for it. Records are written as the zone goes, but only
+flushed and fsynced every `sync_interval` seconds, so a crash loses at most
+that much.
+
+The journal is split into numbered segments. Every snapshot starts a new
+segment and notes the sequence number it covers up to; once the snapshot is
+safely written, the segments before it are deleted. On startup the zone loads
+the latest snapshot and replays whatever records come after it.
+"""
+
+import glob
+import json
+import os
+import re
+from time import monotonic
+
+from figment.logger import log
+
+
+class Journal:
+    def __init__(self, path, sync_interval=1):
+        self.path = path
+        self.sync_interval = sync_interval
+        self.seq = 0
+        self.segment = None
+        self.file = None
+        self._next_sync = 0
+
+    def segment_path(self, segment):
+        return "%s.%s" % (self.path, segment)
+
+    def segments(self):
+        """Return the (number, path) of every segment on disk, oldest first."""
+        pattern = re.compile(re.escape(self.path) + r"\.(\d+)$")
+        segments = []
+        for path in glob.glob(glob.escape(self.path) + ".*"):
+            match = pattern.match(path)
+            if match:
+                segments.append((int(match.group(1)), path))
+        return sorted(segments)
+
+    def open(self):
+        """Start writing to a new segment after any that already exist."""
+        segments = self.segments()
+        self.segment = segments[-1][0] + 1 if segments else 1
+        self.file = open(self.segment_path(self.segment), "a")
+
+    def append(self, kind, data, seed=None):
+        if self.file is None:
+            self.open()
+        self.seq += 1
+        self.file.write(json.dumps([self.seq, kind, data, seed]) + "\n")
+        return self.seq
+
+    def sync(self, force=False):
+        if self.file is None:
+            return
+
+        now = monotonic()
+        if not force and now < self._next_sync:
+            return
+        self._next_sync = now + self.sync_interval
+
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def rotate(self):
+        """
+        Close the current segment, so the next record starts a new one, and
+        return the number of the last segment on disk (or None if there are
+        none).
+        """
+        self.close()
+        segments = self.segments()
+        return segments[-1][0] if segments else None
+
+    def close(self):
+        if self.file is not None:
+            self.sync(force=True)
+            self.file.close()
+            self.file = None
+
+    def truncate(self, through):
+        """Delete the segments up to and including `through`."""
+        for segment, path in self.segments():
+            if segment <= through:
+                os.unlink(path)
+
+    def read(self, after=0):
+        """
+        Yield the (seq, kind, data, seed) of every record after the given one.
+        Records from before seeds were journaled have a seed of None.
+        """
+        for _, path in self.segments():
+            with open(path) as f:
+                for line in f:
+                    try:
+                        seq, kind, data, *seed = json.loads(line)
+                    except ValueError:
+                        # Only the last write before a crash can be torn
+                        log.warning("Ignoring incomplete journal record in %s" % path)
+                        break
+                    if seq > after:
+                        yield seq, kind, data, (seed or [None])[0]
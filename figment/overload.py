@@ -0,0 +1,75 @@
+"""
+Sheds work when a zone can't keep up with its queue.
+
+Once per housekeeping interval the controller looks at how many commands are
+waiting and how long the last batch waited, and moves between pressure levels:
+up a level while either is over its limit, and back down a level once both have
+been under half of it for a few checks running. At every level above zero the
+zone ticks less often (every 2 ** level ticks, with their dt combined), skips the
+tick work of sheddable component classes, and limits how many commands each
+entity gets to run per interval.
+"""
+
+import collections
+
+from figment.logger import log
+
+
+class OverloadController:
+    def __init__(
+        self,
+        backlog=500,
+        lag_ms=1000,
+        max_level=3,
+        commands_per_entity=5,
+        recovery_checks=3,
+    ):
+        self.backlog_limit = backlog
+        self.lag_limit = lag_ms
+        self.max_level = max_level
+        self.commands_per_entity = commands_per_entity
+        self.recovery_checks = recovery_checks
+        self.level = 0
+        self.calm_checks = 0
+        self.commands = collections.Counter()
+
+    @property
+    def overloaded(self):
+        return self.level > 0
+
+    @property
+    def tick_stride(self):
+        return 1 << self.level
+
+    def check(self, backlog, lag_ms):
+        """Update the pressure level from the latest measurements."""
+        self.commands.clear()
+
+        backlog = backlog or 0
+        lag_ms = lag_ms or 0
+
+        if backlog > self.backlog_limit or lag_ms > self.lag_limit:
+            self.calm_checks = 0
+            if self.level < self.max_level:
+                self.level += 1
+                log.warning(
+                    "Overloaded (backlog=%s, lag_ms=%s), now at level %s."
+                    % (backlog, lag_ms, self.level)
+                )
+        elif backlog <= self.backlog_limit / 2 and lag_ms <= self.lag_limit / 2:
+            self.calm_checks += 1
+            if self.level and self.calm_checks >= self.recovery_checks:
+                self.calm_checks = 0
+                self.level -= 1
+                log.info("Load easing, now at level %s." % self.level)
+        else:
+            self.calm_checks = 0
+
+        return self.level
+
+    def admit(self, entity_id):
+        """Count a command from an entity, returning whether it may run."""
+        self.commands[entity_id] += 1
+        return (
+            not self.overloaded or self.commands[entity_id] <= self.commands_per_entity
+        )
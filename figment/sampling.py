@@ -0,0 +1,102 @@
+"""
+Wakes probabilistic components only on the ticks where they would act.
+
+A component with a `tick_chance` of p acts on any given tick with probability
+p, independently of every other tick, so the number of ticks until it next acts
+is geometrically distributed. (For a class with a `tick_every` period, read
+"period" for "tick".) Drawing that number up front and keeping the
+components in a priority queue gives exactly the same behavior as rolling on
+every tick, but a tick only costs as much as the components that act on it.
+"""
+
+import heapq
+import itertools
+import math
+import random
+
+
+def ticks_until_success(chance):
+    """Draw how many ticks pass until an event of probability `chance` occurs."""
+    if chance >= 1:
+        return 1
+    if chance <= 0:
+        return None
+    # 1 - random() lies in (0, 1], so the log is always defined
+    return 1 + int(math.log(1.0 - random.random()) / math.log(1.0 - chance))
+
+
+class TickSampler:
+    def __init__(self):
+        self.now = 0
+        self.queue = []
+        self.due = {}
+        # The tick_chance each component's turn was drawn with
+        self.chances = {}
+        self.counter = itertools.count()
+
+    def __len__(self):
+        return len(self.due)
+
+    def __contains__(self, component):
+        return component in self.due
+
+    def __iter__(self):
+        return iter(self.due)
+
+    def add(self, component):
+        self.chances[component] = component.tick_chance
+        ticks = ticks_until_success(component.tick_chance)
+        due = None if ticks is None else self.now + ticks * max(1, component.tick_every)
+        self.schedule(component, due)
+
+    def schedule(self, component, due):
+        self.due[component] = due
+        if due is not None:
+            heapq.heappush(self.queue, (due, next(self.counter), component))
+
+    def remove(self, component):
+        # Queue entries are discarded lazily, once they reach the front
+        self.due.pop(component, None)
+        self.chances.pop(component, None)
+
+    def advance(self, ticks=1):
+        """Move forward by `ticks`, returning the components that act meanwhile."""
+        self.now += ticks
+        acting = {}
+
+        while self.queue and self.queue[0][0] <= self.now:
+            due, _, component = heapq.heappop(self.queue)
+            # Redrawing a turn can queue a component twice for the same tick
+            if self.due.get(component) == due:
+                acting[component] = None
+
+        return list(acting)
+
+    def to_list(self):
+        """
+        Return each component and the tick it's next due on (None if never),
+        in the order they'll act.
+        """
+        turns = []
+        for due, _, component in sorted(self.queue, key=lambda entry: entry[:2]):
+            if self.due.get(component) == due:
+                turns.append((component, due))
+        # A component can be queued twice for the same tick
+        turns = list(dict(turns).items())
+        return turns + [(c, due) for c, due in self.due.items() if due is None]
+
+    def load_list(self, now, turns):
+        """
+        Restore the turns returned by to_list(), at tick `now`. Components
+        that weren't among them draw new turns.
+        """
+        self.now = now
+        self.queue = []
+        saved = set()
+        for component, due in turns:
+            if component in self.due:
+                self.schedule(component, due)
+                saved.add(component)
+        for component in list(self.due):
+            if component not in saved:
+                self.add(component)
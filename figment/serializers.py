@@ -1,7 +1,10 @@
 """
-Defines a unified interface for saving and loading stuff from strings.
+Defines a unified interface for saving and loading stuff from strings, or
+streaming it to and from binary files.
 """
 
+import struct
+
 # Because serialization libraries other than JSON are optional dependencies,
 # imports should be at method scope so they don't get executed until needed.
 
@@ -19,6 +22,29 @@ class Serializer:
     def unserialize(data):
         raise NotImplementedError
 
+    @classmethod
+    def dump(cls, data, f):
+        f.write(cls.serialize(data))
+
+    @classmethod
+    def load(cls, f):
+        return cls.unserialize(f.read())
+
+    @classmethod
+    def dump_snapshot(cls, header, entities, f):
+        """Write a snapshot's header (a dict) and its entities to a file."""
+        cls.dump(dict(header, entities=list(entities)), f)
+
+    @classmethod
+    def load_snapshot(cls, f):
+        """
+        Read a snapshot from a file, returning its header and an iterator over
+        its entities. Serializers that can should read the entities lazily,
+        one at a time.
+        """
+        data = cls.load(f)
+        return data, iter(data.pop("entities"))
+
 
 class JSONSerializer(Serializer):
     extension = "json"
@@ -35,6 +61,40 @@ class JSONSerializer(Serializer):
 
         return json.loads(data)
 
+    @staticmethod
+    def dump(data, f):
+        import io
+        import json
+
+        text = io.TextIOWrapper(f, encoding="utf-8")
+        json.dump(data, text)
+        text.flush()
+        text.detach()
+
+    @staticmethod
+    def dump_snapshot(header, entities, f):
+        import io
+        import json
+
+        # The header goes on the first line and each entity on its own line
+        # after it, so they can be parsed one at a time
+        text = io.TextIOWrapper(f, encoding="utf-8")
+        text.write(json.dumps(header) + "\n")
+        for entity in entities:
+            text.write(json.dumps(entity) + "\n")
+        text.flush()
+        text.detach()
+
+    @staticmethod
+    def load_snapshot(f):
+        import json
+
+        header = json.loads(f.readline())
+        if "entities" in header:
+            # Written as a single document, before snapshots were streamed
+            return header, iter(header.pop("entities"))
+        return header, (json.loads(line) for line in f if line.strip())
+
 
 class YAMLSerializer(Serializer):
     extension = "yaml"
@@ -51,5 +111,175 @@ class YAMLSerializer(Serializer):
 
         return yaml.safe_load(data)
 
+    @staticmethod
+    def dump(data, f):
+        import yaml
+
+        yaml.dump(data, f, default_flow_style=False, encoding="utf-8")
+
+    @staticmethod
+    def load(f):
+        import yaml
+
+        return yaml.safe_load(f)
+
+
+class BinarySerializer(Serializer):
+    """
+    A compact binary format made of length-prefixed records. Files start with
+    a preamble naming the codec the records were packed with: msgpack if it's
+    installed, or the standard library's marshal otherwise. Each record is
+    framed by the ID of the entity it holds (or -1 for a snapshot's header)
+    and its length, so entities can be streamed one at a time, and scanned
+    for (see `scan`) without unpacking the ones in between.
+
+    Like pickle, marshal isn't safe to use on untrusted data.
+    """
+
+    extension = "bin"
+
+    MAGIC = b"FIG"
+    FRAME = struct.Struct(">qI")
+    HEADER_ID = -1
+
+    @staticmethod
+    def codec(name=None):
+        """Return the name, packer and unpacker of a codec (the best by default)."""
+        if name in (None, b"m"):
+            try:
+                import msgpack
+
+                return (
+                    b"m",
+                    lambda data: msgpack.packb(data, use_bin_type=True),
+                    lambda data: msgpack.unpackb(data, raw=False, strict_map_key=False),
+                )
+            except ImportError:
+                if name is not None:
+                    raise
+        elif name != b"M":
+            raise ValueError("Unrecognized binary snapshot codec %r" % name)
+
+        import marshal
+
+        return b"M", lambda data: marshal.dumps(data, 4), marshal.loads
+
+    @classmethod
+    def serialize(cls, data):
+        import io
+
+        f = io.BytesIO()
+        cls.dump(data, f)
+        return f.getvalue()
+
+    @classmethod
+    def unserialize(cls, data):
+        import io
+
+        return cls.load(io.BytesIO(data))
+
+    @classmethod
+    def dump(cls, data, f):
+        name, pack, _ = cls.codec()
+        f.write(cls.MAGIC + name)
+        cls.write_record(f, pack, cls.HEADER_ID, data)
+
+    @classmethod
+    def load(cls, f):
+        _, unpack = cls.read_preamble(f)
+        _, data = cls.read_record(f, unpack)
+        return data
+
+    @classmethod
+    def dump_snapshot(cls, header, entities, f):
+        name, pack, _ = cls.codec()
+        f.write(cls.MAGIC + name)
+        cls.write_record(f, pack, cls.HEADER_ID, header)
+        for entity in entities:
+            cls.write_record(f, pack, entity["id"], entity)
+
+    @classmethod
+    def load_snapshot(cls, f):
+        _, unpack = cls.read_preamble(f)
+        _, header = cls.read_record(f, unpack)
+        if "entities" in header:
+            return header, iter(header.pop("entities"))
+        return header, cls.read_entities(f, unpack)
+
+    @classmethod
+    def read_entities(cls, f, unpack):
+        while True:
+            record = cls.read_record(f, unpack)
+            if record is None:
+                return
+            yield record[1]
+
+    @classmethod
+    def read_preamble(cls, f):
+        preamble = f.read(len(cls.MAGIC) + 1)
+        if preamble[:-1] != cls.MAGIC:
+            raise ValueError("Not a binary snapshot")
+        return cls.codec(preamble[-1:])[1:]
+
+    @classmethod
+    def write_record(cls, f, pack, id, data):
+        payload = pack(data)
+        f.write(cls.FRAME.pack(id, len(payload)))
+        f.write(payload)
+
+    @classmethod
+    def read_frame(cls, f):
+        frame = f.read(cls.FRAME.size)
+        if not frame:
+            return None
+        if len(frame) < cls.FRAME.size:
+            raise EOFError("Binary snapshot ended unexpectedly")
+        return cls.FRAME.unpack(frame)
+
+    @classmethod
+    def read_record(cls, f, unpack):
+        """Read the next record, returning its ID and data (or None at the end)."""
+        frame = cls.read_frame(f)
+        if frame is None:
+            return None
+        id, length = frame
+        payload = f.read(length)
+        if len(payload) < length:
+            raise EOFError("Binary snapshot ended unexpectedly")
+        return id, unpack(payload)
+
+    @classmethod
+    def scan(cls, f):
+        """
+        Yield the ID, offset and length of every record in a file, skipping
+        over the records themselves. Given an offset, `read_at` reads one.
+        """
+        cls.read_preamble(f)
+        while True:
+            offset = f.tell()
+            frame = cls.read_frame(f)
+            if frame is None:
+                return
+            id, length = frame
+            yield id, offset, length
+            if f.seekable():
+                f.seek(length, 1)
+            else:
+                f.read(length)
+
+    @classmethod
+    def read_at(cls, f, offset):
+        f.seek(0)
+        _, unpack = cls.read_preamble(f)
+        f.seek(offset)
+        return cls.read_record(f, unpack)[1]
+
+
+# Formats that configs can be written in
+SERIALIZERS = {
+    "json": JSONSerializer,
+    "yaml": YAMLSerializer,
+}
 
-SERIALIZERS = {"json": JSONSerializer, "yaml": YAMLSerializer}
+# Formats that snapshots can be saved in
+SNAPSHOT_SERIALIZERS = dict(SERIALIZERS, bin=BinarySerializer)
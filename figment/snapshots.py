@@ -0,0 +1,198 @@
+"""
+Reading and writing snapshot files.
+
+A full snapshot (the base image) records every entity in the zone. With
+incremental snapshots enabled, most saves instead write a delta segment next to
+it, holding only the entities that changed or were destroyed since the last
+save. Every base image is numbered with a generation, and its deltas are named
+after it, so deltas left over from an older base are never applied to a newer
+one. Once enough deltas pile up, the next save compacts them into a new base.
+
+Snapshots can be compressed with zlib, gzip or lzma. They're streamed through
+the compressor as they're serialized, and decompressed a chunk at a time as
+they're read, so the whole compressed file is never held in memory. Reading
+works out the compression from the file itself, so changing the setting
+doesn't strand existing snapshots.
+"""
+
+import contextlib
+import glob
+import io
+import os
+import re
+import shutil
+import tempfile
+import zlib
+
+CHUNK_SIZE = 64 * 1024
+
+COMPRESSIONS = ("zlib", "gzip", "lzma")
+
+
+def delta_path(snapshot_path, generation, index):
+    return "%s.delta-%s-%s" % (snapshot_path, generation, index)
+
+
+def delta_paths(snapshot_path, generation=None):
+    """Return the paths of a base image's deltas, in the order they were saved."""
+    pattern = re.compile(re.escape(snapshot_path) + r"\.delta-(\d+)-(\d+)$")
+    paths = []
+    for path in glob.glob(glob.escape(snapshot_path) + ".delta-*"):
+        match = pattern.match(path)
+        if match and (generation is None or int(match.group(1)) == generation):
+            paths.append((int(match.group(2)), path))
+    return [path for _, path in sorted(paths)]
+
+
+class ZlibWriter(io.RawIOBase):
+    """Compresses whatever's written to it into another file."""
+
+    def __init__(self, f):
+        self.f = f
+        self.compressor = zlib.compressobj()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.f.write(self.compressor.compress(data))
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self.f.write(self.compressor.flush())
+        super().close()
+
+
+class ZlibReader(io.RawIOBase):
+    """Decompresses another file as it's read."""
+
+    def __init__(self, f):
+        self.f = f
+        self.decompressor = zlib.decompressobj()
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.decompressor.eof:
+            data = self.decompressor.unconsumed_tail or self.f.read(CHUNK_SIZE)
+            if not data:
+                raise EOFError("Compressed snapshot ended unexpectedly")
+            decompressed = self.decompressor.decompress(data, len(buffer))
+            if decompressed:
+                buffer[: len(decompressed)] = decompressed
+                return len(decompressed)
+        return 0
+
+
+def compressing(f, compression):
+    if compression == "zlib":
+        return io.BufferedWriter(ZlibWriter(f), CHUNK_SIZE)
+    if compression == "gzip":
+        import gzip
+
+        return gzip.GzipFile(fileobj=f, mode="wb")
+    if compression == "lzma":
+        import lzma
+
+        return lzma.LZMAFile(f, "wb")
+    return f
+
+
+def decompressing(f):
+    """Wrap a file to decompress it however it was compressed, if at all."""
+    header = f.peek(6)[:6]
+    if header.startswith(b"\x1f\x8b"):
+        import gzip
+
+        return gzip.GzipFile(fileobj=f, mode="rb")
+    if header.startswith(b"\xfd7zXZ\x00"):
+        import lzma
+
+        return lzma.LZMAFile(f, "rb")
+    # zlib streams start with a CMF byte for deflate and a check value
+    if (
+        len(header) >= 2
+        and header[0] == 0x78
+        and (header[0] * 256 + header[1]) % 31 == 0
+    ):
+        return io.BufferedReader(ZlibReader(f), CHUNK_SIZE)
+    return f
+
+
+@contextlib.contextmanager
+def reading(path):
+    """Open a snapshot file for reading, decompressing it if need be."""
+    with open(path, "rb") as f:
+        yield decompressing(f)
+
+
+@contextlib.contextmanager
+def writing(path, compression=None):
+    """
+    Open a snapshot file for writing, through a compressor if `compression`
+    is given. It's written atomically, by way of a temporary file.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    f = tempfile.NamedTemporaryFile(dir=directory, delete=False)
+    try:
+        stream = compressing(f, compression)
+        yield stream
+        if stream is not f:
+            stream.close()
+        f.close()
+        shutil.move(f.name, path)
+    except BaseException:
+        f.close()
+        os.unlink(f.name)
+        raise
+
+
+def read(path, serializer):
+    """Read a whole snapshot file into a dict."""
+    with reading(path) as f:
+        header, entities = serializer.load_snapshot(f)
+        return dict(header, entities=list(entities))
+
+
+def write(path, serializer, data, compression=None):
+    """Write a snapshot file from a dict, streaming its entities if it can."""
+    header = dict(data)
+    entities = header.pop("entities")
+    with writing(path, compression) as f:
+        serializer.dump_snapshot(header, entities, f)
+
+
+def read_deltas(paths, serializer):
+    """
+    Read a base image's deltas, returning what they override (a dict of the
+    newest entity dicts by ID, with None for destroyed entities) and the
+    header of the newest one, or None if there aren't any.
+    """
+    overrides = {}
+    header = None
+    for path in paths:
+        with reading(path) as f:
+            header, entity_dicts = serializer.load_snapshot(f)
+            for id in header["destroyed"]:
+                overrides[id] = None
+            for entity_dict in entity_dicts:
+                overrides[entity_dict["id"]] = entity_dict
+    return overrides, header
+
+
+def apply_deltas(entity_dicts, overrides):
+    """
+    Yield a base image's entity dicts as its deltas left them, given what
+    the deltas override (see read_deltas).
+    """
+    for entity_dict in entity_dicts:
+        entity_dict = overrides.pop(entity_dict["id"], entity_dict)
+        if entity_dict is not None:
+            yield entity_dict
+
+    # Entities created since the base image
+    for entity_dict in overrides.values():
+        if entity_dict is not None:
+            yield entity_dict
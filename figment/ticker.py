@@ -0,0 +1,91 @@
+from time import monotonic
+
+
+class TickClock:
+    """
+    Schedules ticks against fixed monotonic deadlines, so time spent pushing a
+    tick (or a late wakeup) never accumulates into drift. Each tick payload
+    carries its sequence number and the time actually elapsed since the
+    previous tick; if whole intervals were missed, the sequence skips ahead
+    rather than firing a burst of catch-up ticks.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.seq = 0
+        self.started = None
+        self.last = None
+
+    def delay(self):
+        """Seconds until the next tick is due."""
+        if self.started is None:
+            return 0
+        return max(0, self.started + (self.seq + 1) * self.interval - monotonic())
+
+    def next_tick(self):
+        now = monotonic()
+
+        if self.started is None:
+            self.started = self.last = now
+            dt = self.interval
+        else:
+            self.seq = max(self.seq + 1, int((now - self.started) / self.interval))
+            dt = now - self.last
+            self.last = now
+
+        return format_tick(self.seq, dt)
+
+
+def format_tick(seq, dt):
+    return "%s %.6f" % ("-" if seq is None else seq, dt)
+
+
+def parse_tick(payload):
+    """
+    Return the (seq, dt) pair from a tick payload. Payloads from older tickers
+    carry neither, in which case both are None.
+    """
+    seq, _, dt = str(payload).partition(" ")
+    if not dt:
+        return None, None
+    return (None if seq == "-" else int(seq)), float(dt)
+
+
+def merge_ticks(payloads, default_dt):
+    """Combine several tick payloads into one spanning all of their time."""
+    seqs = []
+    total_dt = 0
+    for payload in payloads:
+        seq, dt = parse_tick(payload)
+        if seq is not None:
+            seqs.append(seq)
+        total_dt += default_dt if dt is None else dt
+    return format_tick(max(seqs) if seqs else None, total_dt)
+
+
+class TickBucket:
+    """
+    The ticking component classes that share a tick period. Ticks accumulate
+    in the bucket until a whole period has passed, then its classes are ticked
+    once with the time elapsed over all of them.
+    """
+
+    def __init__(self, period):
+        self.period = period
+        self.classes = {}
+        self.ticks = 0
+        self.dt = 0
+
+    def advance(self, ticks, dt):
+        """
+        Count `ticks` more ticks, returning the bucket's dt if it's now due.
+        Classes that tick with the zone are due on every tick event, even one
+        too short to count as a whole tick.
+        """
+        self.ticks += ticks
+        self.dt += dt
+        if self.period > 1 and self.ticks < self.period:
+            return None
+
+        dt, self.ticks, self.dt = self.dt, 0, 0
+        return dt
@@ -0,0 +1,166 @@
+"""
+Delayed callbacks, driven by zone ticks.
+
+Timers live in a hierarchical timing wheel: the first level has one slot per
+tick for the next SLOTS ticks, and every following level has slots covering
+SLOTS times as many ticks as the level below it. Advancing a tick only looks
+at the current first-level slot (and, every SLOTS ticks, redistributes one
+slot from the level above), so idle timers cost nothing no matter how many
+there are.
+
+Callbacks are stored by reference rather than as Python objects -- a component
+method by entity ID, component class name and method name, or a module-level
+function by its import path -- so they can be saved in snapshots and still
+behave sensibly if their entity has been destroyed in the meantime.
+"""
+
+import importlib
+import inspect
+
+from figment.component import Component
+from figment.logger import log
+
+SLOT_BITS = 6
+SLOTS = 1 << SLOT_BITS
+SLOT_MASK = SLOTS - 1
+LEVELS = 4
+
+
+def callback_to_dict(callback):
+    component = getattr(callback, "__self__", None)
+    if isinstance(component, Component):
+        if component.entity is None:
+            raise ValueError("Can't schedule a method of a detached component")
+        return {
+            "entity_id": component.entity.id,
+            "component": component.__class__.__name__,
+            "method": callback.__name__,
+        }
+
+    if (
+        inspect.isfunction(callback)
+        and "<" not in callback.__qualname__
+        and getattr(importlib.import_module(callback.__module__), callback.__name__)
+        is callback
+    ):
+        return {"function": "%s:%s" % (callback.__module__, callback.__qualname__)}
+
+    raise ValueError(
+        "Only component methods and module-level functions can be scheduled, "
+        "not %r" % (callback,)
+    )
+
+
+def callback_from_dict(dict_, zone):
+    """Resolve a stored callback, or return None if it no longer exists."""
+    if "function" in dict_:
+        module_name, _, name = dict_["function"].partition(":")
+        return getattr(importlib.import_module(module_name), name)
+
+    entity = zone.get(dict_["entity_id"])
+    if entity is None or not entity.is_(dict_["component"]):
+        return None
+    return getattr(getattr(entity, dict_["component"]), dict_["method"])
+
+
+class Timer:
+    def __init__(self, due, callback, args=()):
+        self.due = due
+        self.callback = callback
+        self.args = list(args)
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerWheel:
+    def __init__(self):
+        self.now = 0
+        self.levels = [[[] for _ in range(SLOTS)] for _ in range(LEVELS)]
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def add(self, timer):
+        delta = timer.due - self.now
+
+        if delta < SLOTS:
+            # Timers that are already due fire on the next advance
+            slot = max(timer.due, self.now) & SLOT_MASK
+            self.levels[0][slot].append(timer)
+        else:
+            for level in range(1, LEVELS):
+                if delta < 1 << (SLOT_BITS * (level + 1)) or level == LEVELS - 1:
+                    break
+
+            # Anything beyond the last level's range waits in its furthest
+            # slot and is redistributed (and re-checked) when that comes up
+            due = min(timer.due, self.now + (1 << (SLOT_BITS * LEVELS)) - 1)
+            slot = (due >> (SLOT_BITS * level)) & SLOT_MASK
+            self.levels[level][slot].append(timer)
+
+        self.count += 1
+        return timer
+
+    def schedule(self, ticks, callback, args=()):
+        """Fire `callback` on the `ticks`-th advance from now (at least 1)."""
+        return self.add(Timer(self.now + max(1, ticks) - 1, callback, args))
+
+    def cascade(self, level):
+        slot = (self.now >> (SLOT_BITS * level)) & SLOT_MASK
+        timers, self.levels[level][slot] = self.levels[level][slot], []
+        self.count -= len(timers)
+        for timer in timers:
+            self.add(timer)
+        return slot
+
+    def advance(self, ticks=1):
+        """Move forward by `ticks`, returning the timers that came due."""
+        due = []
+
+        for _ in range(ticks):
+            slot = self.now & SLOT_MASK
+
+            if slot == 0:
+                for level in range(1, LEVELS):
+                    if self.cascade(level) != 0:
+                        break
+
+            timers, self.levels[0][slot] = self.levels[0][slot], []
+            self.count -= len(timers)
+            due.extend(timer for timer in timers if not timer.cancelled)
+            self.now += 1
+
+        return due
+
+    def timers(self):
+        for level in self.levels:
+            for slot in level:
+                for timer in slot:
+                    if not timer.cancelled:
+                        yield timer
+
+    def to_list(self):
+        return [
+            {
+                "ticks": timer.due - self.now + 1,
+                "callback": timer.callback,
+                "args": timer.args,
+            }
+            for timer in sorted(self.timers(), key=lambda timer: timer.due)
+        ]
+
+    def load_list(self, timers):
+        for dict_ in timers:
+            self.schedule(dict_["ticks"], dict_["callback"], dict_["args"])
+
+
+def fire(timers, zone):
+    for timer in timers:
+        callback = callback_from_dict(timer.callback, zone)
+        if callback is None:
+            log.debug("Dropping timer for missing callback %r" % timer.callback)
+            continue
+        callback(*timer.args)
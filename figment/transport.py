@@ -0,0 +1,561 @@
+"""
+Defines how commands and ticks reach a zone, and how messages get back out to
+the entities' clients.
+"""
+
+import collections
+import queue
+import threading
+from time import time
+
+from redis import Redis
+from redis.exceptions import ConnectionError, ResponseError
+
+TICK = "tick"
+COMMAND = "command"
+
+# Pops up to ARGV[1] entries, preferring ticks over commands just as BLPOP
+# does, so a drained batch is ordered exactly as successive BLPOPs would be.
+DRAIN_SCRIPT = """
+local entries = {}
+for i = 1, tonumber(ARGV[1]) do
+    local key = KEYS[1]
+    local value = redis.call("LPOP", key)
+    if not value then
+        key = KEYS[2]
+        value = redis.call("LPOP", key)
+        if not value then
+            break
+        end
+    end
+    entries[#entries + 1] = key
+    entries[#entries + 1] = value
+end
+return entries
+"""
+
+
+class TransportError(Exception):
+    pass
+
+
+class Event(tuple):
+    """
+    A (kind, value) pair. Transports may also tag an event with their own `id`
+    (needed to acknowledge it) and the time it was `queued_at`, by the zone's
+    clock.
+    """
+
+    def __new__(cls, kind, value, id=None, queued_at=None):
+        self = tuple.__new__(cls, (kind, value))
+        self.id = id
+        self.queued_at = queued_at
+        return self
+
+    @property
+    def kind(self):
+        return self[0]
+
+    @property
+    def value(self):
+        return self[1]
+
+
+class Subscription:
+    def get_message(self, timeout=0):
+        """
+        Return the next message published to the subscribed entity, waiting
+        up to `timeout` seconds (forever if None), or None if there wasn't one.
+        """
+        raise NotImplementedError
+
+    def listen(self):
+        while True:
+            message = self.get_message(timeout=None)
+            if message is not None:
+                yield message
+
+    def close(self):
+        pass
+
+
+class Transport:
+    # Whether the zone, its ticker and its clients must share one process
+    in_process = False
+
+    def __init__(self, zone_id, config):
+        self.zone_id = zone_id
+
+    def ping(self):
+        """Raise TransportError if the transport is unusable."""
+
+    def enqueue_command(self, entity_id, command):
+        raise NotImplementedError
+
+    def push_tick(self, payload):
+        raise NotImplementedError
+
+    def clear_ticks(self):
+        raise NotImplementedError
+
+    def backlog(self):
+        """Return how many commands are waiting, or None if it can't be known."""
+        return None
+
+    def receive(self, count=1, timeout=None):
+        """
+        Wait up to `timeout` seconds (forever if None, not at all if 0) for an
+        event, then take up to `count` of them. Events are (kind, value) pairs
+        where kind is TICK or COMMAND, and pending ticks always come before
+        commands.
+        """
+        raise NotImplementedError
+
+    def requeue(self, events):
+        """Put received but unprocessed events back at the front of the queue."""
+        raise NotImplementedError
+
+    def drain_ticks(self):
+        """Take every tick that is waiting, without blocking."""
+        raise NotImplementedError
+
+    def ack(self, events):
+        """Confirm that received events have been processed."""
+
+    def publish(self, messages):
+        """Send a sequence of (entity_id, message) pairs."""
+        raise NotImplementedError
+
+    def subscribe(self, entity_id):
+        raise NotImplementedError
+
+    def aio(self):
+        """Return an equivalent transport for use from an asyncio event loop."""
+        from figment.aio import ThreadedAsyncTransport
+
+        return ThreadedAsyncTransport(self)
+
+
+class RedisSubscription(Subscription):
+    def __init__(self, pubsub):
+        self.pubsub = pubsub
+
+    def get_message(self, timeout=0):
+        message = self.pubsub.get_message(timeout=timeout)
+        if message:
+            return message["data"]
+
+    def close(self):
+        self.pubsub.close()
+
+
+class RedisTransport(Transport):
+    def __init__(self, zone_id, config):
+        super(RedisTransport, self).__init__(zone_id, config)
+        self.host = config.get("host", "localhost")
+        self.port = config.get("port", 6379)
+        self.redis = Redis(self.host, self.port)
+        self.drain_script = self.redis.register_script(DRAIN_SCRIPT)
+
+    @property
+    def tick_key(self):
+        return "zone:%s:tick" % self.zone_id
+
+    @property
+    def incoming_key(self):
+        return "zone:%s:incoming" % self.zone_id
+
+    @staticmethod
+    def messages_key(entity_id):
+        return "entity:%s:messages" % entity_id
+
+    def key_for(self, kind):
+        return self.tick_key if kind == TICK else self.incoming_key
+
+    def decode(self, key, value):
+        # List entries don't say when they were queued, so lag is measured
+        # from when the zone took them, on the zone's own clock
+        kind = TICK if key.decode("utf-8") == self.tick_key else COMMAND
+        return Event(kind, value.decode("utf-8"), queued_at=time())
+
+    def ping(self):
+        try:
+            self.redis.ping()
+        except ConnectionError as e:
+            raise TransportError("Redis error: %s" % e)
+
+    def enqueue_command(self, entity_id, command):
+        self.redis.rpush(self.incoming_key, " ".join([str(entity_id), command]))
+
+    def push_tick(self, payload):
+        self.redis.rpush(self.tick_key, payload)
+
+    def clear_ticks(self):
+        self.redis.ltrim(self.tick_key, 0, 0)
+
+    def backlog(self):
+        return self.redis.llen(self.incoming_key)
+
+    def receive(self, count=1, timeout=None):
+        keys = [self.tick_key, self.incoming_key]
+
+        # BLPOP treats a timeout of 0 as forever
+        if timeout == 0:
+            drained = self.drain_script(keys=keys, args=[count])
+            return [
+                self.decode(key, value)
+                for key, value in zip(drained[::2], drained[1::2])
+            ]
+
+        event = self.redis.blpop(keys, timeout=timeout or 0)
+        if event is None:
+            return []
+        events = [event]
+
+        if count > 1:
+            drained = self.drain_script(keys=keys, args=[count - 1])
+            events.extend(zip(drained[::2], drained[1::2]))
+
+        return [self.decode(key, value) for key, value in events]
+
+    def requeue(self, events):
+        pipeline = self.redis.pipeline()
+        for kind, value in reversed(events):
+            pipeline.lpush(self.key_for(kind), value)
+        pipeline.execute()
+
+    def drain_ticks(self):
+        pipeline = self.redis.pipeline()
+        pipeline.lrange(self.tick_key, 0, -1)
+        pipeline.delete(self.tick_key)
+        values, _ = pipeline.execute()
+        return [Event(TICK, value.decode("utf-8")) for value in values]
+
+    def publish(self, messages):
+        pipeline = self.redis.pipeline(transaction=False)
+        for entity_id, message in messages:
+            pipeline.publish(self.messages_key(entity_id), message)
+        pipeline.execute()
+
+    def subscribe(self, entity_id):
+        pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.messages_key(entity_id))
+        return RedisSubscription(pubsub)
+
+    def aio(self):
+        from figment.aio import AsyncRedisTransport
+
+        return AsyncRedisTransport(self)
+
+
+class RedisStreamsTransport(RedisTransport):
+    """
+    Reads ticks and commands from Redis streams through a consumer group
+    instead of lists. Events stay pending until the zone acknowledges them
+    after processing, so a crashed zone replays them when it restarts (it's
+    at-least-once: commands from a batch that was cut short may run twice).
+    """
+
+    def __init__(self, zone_id, config):
+        super(RedisStreamsTransport, self).__init__(zone_id, config)
+        self.group = config.get("group", "figment")
+        self.consumer = config.get("consumer", "zone:%s" % zone_id)
+        self.tick_maxlen = config.get("tick_maxlen", 1000)
+        self.buffer = collections.deque()
+        self.replay_ids = {self.tick_key: "0", self.incoming_key: "0"}
+        self.groups_created = False
+        # How far the Redis server's clock is ahead of ours. Entry IDs carry
+        # the server's time, so lag measured from them is corrected by this.
+        self.clock_offset = 0
+
+    @property
+    def replaying(self):
+        return self.replay_ids is not None
+
+    @property
+    def tick_key(self):
+        return "zone:%s:tick:stream" % self.zone_id
+
+    @property
+    def incoming_key(self):
+        return "zone:%s:incoming:stream" % self.zone_id
+
+    def ensure_groups(self):
+        if self.groups_created:
+            return
+
+        # Commands sent while no zone was running are still processed, but
+        # stale ticks are not
+        for key, id in ((self.tick_key, "$"), (self.incoming_key, "0")):
+            try:
+                self.redis.xgroup_create(key, self.group, id=id, mkstream=True)
+            except ResponseError as e:
+                if "BUSYGROUP" not in str(e):
+                    raise
+        self.groups_created = True
+
+        before = time()
+        self.set_clock(self.redis.time(), before, time())
+
+    def set_clock(self, server_time, before, after):
+        """Work out the clock offset from a TIME reply taken between two times."""
+        seconds, microseconds = server_time
+        self.clock_offset = seconds + microseconds / 1e6 - (before + after) / 2
+
+    def read_args(self, count, timeout):
+        # Entries still pending from before a restart are read (without
+        # blocking) ahead of any new ones
+        if self.replaying:
+            streams = dict(self.replay_ids)
+        else:
+            streams = {self.tick_key: ">", self.incoming_key: ">"}
+
+        if self.replaying or timeout == 0:
+            block = None
+        elif timeout is None:
+            block = 0
+        else:
+            # XREADGROUP treats 0 as forever, so round short waits up
+            block = max(1, int(timeout * 1000))
+
+        return {
+            "groupname": self.group,
+            "consumername": self.consumer,
+            "streams": streams,
+            "count": count,
+            "block": block,
+        }
+
+    def parse(self, response):
+        events = []
+        deleted = []
+
+        for key, entries in response or []:
+            key = key.decode("utf-8")
+            kind = TICK if key == self.tick_key else COMMAND
+            for entry_id, fields in entries:
+                if self.replaying:
+                    self.replay_ids[key] = entry_id
+                if not fields:
+                    deleted.append((key, entry_id))
+                    continue
+                events.append(
+                    Event(
+                        kind,
+                        fields[b"data"].decode("utf-8"),
+                        id=(key, entry_id),
+                        queued_at=int(entry_id.split(b"-")[0]) / 1000.0
+                        - self.clock_offset,
+                    )
+                )
+
+        if self.replaying and not events and not deleted:
+            self.replay_ids = None
+
+        return events, deleted
+
+    def enqueue_command(self, entity_id, command):
+        self.redis.xadd(
+            self.incoming_key, {"data": " ".join([str(entity_id), command])}
+        )
+
+    def push_tick(self, payload):
+        self.redis.xadd(
+            self.tick_key,
+            {"data": payload},
+            maxlen=self.tick_maxlen,
+            approximate=True,
+        )
+
+    def clear_ticks(self):
+        self.ensure_groups()
+        self.redis.xgroup_setid(self.tick_key, self.group, "$")
+
+    def backlog(self):
+        # Entries are deleted once acknowledged, so everything left in the
+        # stream is either unread or still being processed. The clock offset
+        # is kept up to date on the way.
+        pipeline = self.redis.pipeline(transaction=False)
+        pipeline.xlen(self.incoming_key)
+        pipeline.time()
+        before = time()
+        length, server_time = pipeline.execute()
+        self.set_clock(server_time, before, time())
+        return length
+
+    def receive(self, count=1, timeout=None):
+        self.ensure_groups()
+
+        while not self.buffer:
+            replaying = self.replaying
+            events, deleted = self.parse(
+                self.redis.xreadgroup(**self.read_args(count, timeout))
+            )
+            if deleted:
+                self.acknowledge(deleted)
+            self.buffer.extend(events)
+            # Only a read of new entries can come back empty from waiting
+            if not events and not replaying:
+                break
+
+        events = []
+        while self.buffer and len(events) < count:
+            events.append(self.buffer.popleft())
+        return events
+
+    def requeue(self, events):
+        # Unprocessed events are still pending in the group, so they only
+        # need to come back out of the next receive
+        self.buffer.extendleft(reversed(events))
+
+    def drain_args(self):
+        return {
+            "groupname": self.group,
+            "consumername": self.consumer,
+            "streams": {self.tick_key: ">"},
+        }
+
+    def drain_buffered_ticks(self):
+        ticks = [event for event in self.buffer if event.kind == TICK]
+        if ticks:
+            self.buffer = collections.deque(
+                event for event in self.buffer if event.kind != TICK
+            )
+        return ticks
+
+    def drain_ticks(self):
+        # Ticks pending from before a restart come out of the replay instead
+        if self.replaying:
+            return self.drain_buffered_ticks()
+
+        events, _ = self.parse(self.redis.xreadgroup(**self.drain_args()))
+        return self.drain_buffered_ticks() + events
+
+    def ack(self, events):
+        self.acknowledge([event.id for event in events])
+
+    def acknowledge(self, ids):
+        if not ids:
+            return
+
+        ids_by_key = {}
+        for key, entry_id in ids:
+            ids_by_key.setdefault(key, []).append(entry_id)
+
+        pipeline = self.redis.pipeline(transaction=False)
+        for key, entry_ids in ids_by_key.items():
+            pipeline.xack(key, self.group, *entry_ids)
+            pipeline.xdel(key, *entry_ids)
+        pipeline.execute()
+
+    def aio(self):
+        from figment.aio import AsyncRedisStreamsTransport
+
+        return AsyncRedisStreamsTransport(self)
+
+
+class MemorySubscription(Subscription):
+    def __init__(self, transport, entity_id):
+        self.transport = transport
+        self.entity_id = entity_id
+        self.queue = queue.Queue()
+
+    def get_message(self, timeout=0):
+        try:
+            return self.queue.get(block=timeout != 0, timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        with self.transport.condition:
+            self.transport.subscriptions[self.entity_id].remove(self)
+
+
+class MemoryTransport(Transport):
+    """
+    Keeps every queue inside the zone's own process, so no Redis server is
+    needed. Anything that talks to the zone (the ticker and any clients) has
+    to run in that same process and go through `zone.transport`.
+    """
+
+    in_process = True
+
+    def __init__(self, zone_id, config):
+        super(MemoryTransport, self).__init__(zone_id, config)
+        self.condition = threading.Condition()
+        self.ticks = collections.deque()
+        self.incoming = collections.deque()
+        self.subscriptions = {}
+
+    def queue_for(self, kind):
+        return self.ticks if kind == TICK else self.incoming
+
+    def enqueue_command(self, entity_id, command):
+        with self.condition:
+            self.incoming.append(
+                Event(COMMAND, " ".join([str(entity_id), command]), queued_at=time())
+            )
+            self.condition.notify()
+
+    def push_tick(self, payload):
+        with self.condition:
+            self.ticks.append(Event(TICK, str(payload), queued_at=time()))
+            self.condition.notify()
+
+    def clear_ticks(self):
+        with self.condition:
+            self.ticks.clear()
+
+    def backlog(self):
+        with self.condition:
+            return len(self.incoming)
+
+    def receive(self, count=1, timeout=None):
+        with self.condition:
+            if not self.condition.wait_for(
+                lambda: self.ticks or self.incoming, timeout
+            ):
+                return []
+
+            events = []
+            while len(events) < count:
+                if self.ticks:
+                    events.append(self.ticks.popleft())
+                elif self.incoming:
+                    events.append(self.incoming.popleft())
+                else:
+                    break
+            return events
+
+    def requeue(self, events):
+        with self.condition:
+            for event in reversed(events):
+                if not isinstance(event, Event):
+                    event = Event(*event)
+                self.queue_for(event.kind).appendleft(event)
+            self.condition.notify()
+
+    def drain_ticks(self):
+        with self.condition:
+            ticks = list(self.ticks)
+            self.ticks.clear()
+            return ticks
+
+    def publish(self, messages):
+        with self.condition:
+            for entity_id, message in messages:
+                for subscription in self.subscriptions.get(entity_id, ()):
+                    subscription.queue.put(message)
+
+    def subscribe(self, entity_id):
+        subscription = MemorySubscription(self, entity_id)
+        with self.condition:
+            self.subscriptions.setdefault(entity_id, []).append(subscription)
+        return subscription
+
+
+TRANSPORTS = {
+    "redis": RedisTransport,
+    "redis-streams": RedisStreamsTransport,
+    "memory": MemoryTransport,
+}
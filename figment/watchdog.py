@@ -0,0 +1,123 @@
+"""
+Finds out what slow events are spending their time on.
+
+The zone tells the watchdog whenever it starts and finishes an event. A
+background thread checks in every `sample_interval_ms`, and once an event has
+run for longer than `threshold_ms` it records where the processing thread is
+(the innermost few frames of its stack) each time. When a slow event finishes,
+the most frequently seen stacks are logged along with what the event was, so
+pathological commands and actions can be tracked down in production without
+running a profiler.
+
+Across events, samples are only totalled by action name (or just "command" or
+"tick") and stack, since commands are free-form text and totalling by each one
+would grow without bound.
+"""
+
+import collections
+import os
+import sys
+import threading
+import traceback
+from time import monotonic, sleep
+
+from figment.logger import log
+
+
+class Watchdog:
+    def __init__(self, threshold_ms=100, sample_interval_ms=10, frames=5, top=3):
+        self.threshold = threshold_ms / 1000
+        self.sample_interval = sample_interval_ms / 1000
+        self.frames = frames
+        self.top = top
+        # (thread ID, start time, context) for the event being processed
+        self.current = None
+        self.samples = collections.Counter()
+        # Samples from every slow event so far, by name and stack
+        self.hot_stacks = collections.Counter()
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        while self.running:
+            sleep(self.sample_interval)
+            self.sample()
+
+    def begin(self, **context):
+        self.samples = collections.Counter()
+        self.current = (threading.get_ident(), monotonic(), context)
+
+    def tag(self, **context):
+        """Add details about the current event as they become known."""
+        current = self.current
+        if current is not None:
+            current[2].update(context)
+
+    def end(self):
+        """Finish the current event, returning its duration if it was slow."""
+        current, self.current = self.current, None
+        if current is None or not self.samples:
+            return None
+
+        _, started, context = current
+        elapsed_ms = int((monotonic() - started) * 1000)
+        label = describe(context)
+        name = summarize(context)
+        for stack, count in self.samples.items():
+            self.hot_stacks[(name, stack)] += count
+
+        log.warning(
+            "Slow event (%sms): %s\n%s"
+            % (
+                elapsed_ms,
+                label,
+                "\n".join(
+                    "  %s samples in %s" % (count, stack)
+                    for stack, count in self.samples.most_common(self.top)
+                ),
+            )
+        )
+        return elapsed_ms
+
+    def sample(self):
+        current = self.current
+        if current is None:
+            return
+
+        thread_id, started, _ = current
+        if monotonic() - started < self.threshold:
+            return
+
+        frame = sys._current_frames().get(thread_id)
+        if frame is None or self.current is not current:
+            return
+
+        self.samples[format_stack(frame, self.frames)] += 1
+
+
+def format_stack(frame, limit):
+    return " < ".join(
+        "%s:%s(%s)" % (os.path.basename(summary.filename), summary.lineno, summary.name)
+        for summary in reversed(traceback.extract_stack(frame, limit=limit))
+    )
+
+
+def describe(context):
+    return ", ".join("%s=%s" % item for item in sorted(context.items()))
+
+
+def summarize(context):
+    if "action" in context:
+        return context["action"]
+    return "tick" if "tick" in context else "command"
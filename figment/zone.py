@@ -1,22 +1,32 @@
 import sys
 import os
-import tempfile
-import shutil
 
-# import zlib
 import traceback
 import importlib
 import inspect
-from time import sleep
+import collections
+import contextlib
+import threading
+import math
+import random
+from time import sleep, monotonic, time
 
-from redis import Redis
-from redis.connection import ConnectionError
 from figment.component import Component
 from figment.mode import Mode
 from figment.entity import Entity
 from figment.logger import log
-from figment.serializers import SERIALIZERS
+from figment.serializers import SERIALIZERS, SNAPSHOT_SERIALIZERS
 from figment.debug import DefaultRenderer
+from figment.transport import TRANSPORTS, TICK, Event, TransportError
+from figment.ticker import TickClock, TickBucket, parse_tick, merge_ticks
+from figment.timers import TimerWheel, callback_to_dict, fire
+from figment.sampling import TickSampler
+from figment.overload import OverloadController
+from figment.fairness import FairQueue
+from figment.actions import Action
+from figment.watchdog import Watchdog
+from figment.journal import Journal
+from figment import snapshots
 
 
 def fatal(message):
@@ -24,6 +34,29 @@ def fatal(message):
     sys.exit(1)
 
 
+def configure(cls, config, name):
+    """
+    Create an optional zone feature from its config section, which may be
+    omitted or false (the feature is off), true (it's on with its defaults),
+    or a mapping of arguments to `cls`.
+    """
+    if not config:
+        return None
+    if config is True:
+        config = {}
+    if not isinstance(config, dict):
+        fatal("Expected a mapping of settings for '%s'" % name)
+
+    parameters = inspect.signature(cls).parameters
+    unknown = sorted(set(config) - set(parameters))
+    if unknown:
+        fatal(
+            "Unrecognized setting(s) for '%s': %s (expected any of: %s)"
+            % (name, ", ".join(unknown), ", ".join(parameters))
+        )
+    return cls(**config)
+
+
 class Zone:
     def __init__(self):
         self.id = None
@@ -32,11 +65,72 @@ class Zone:
         self.components = {}
         self.renderer_class = DefaultRenderer
         self.entities_by_component_name = {}
-        self.ticking_entities = set()
+        # Live ticking components, grouped by class. Each group is a dict used
+        # as an insertion-ordered set, so ticks run in a repeatable order.
+        self.ticking_components = {}
+        # The same classes, grouped by their tick_every period
+        self.tick_buckets = {}
+        self.timers = TimerWheel()
+        # Actions paused by a Wait (their timers' callbacks are the actions
+        # themselves), and those waiting to resume as soon as possible
+        self.action_timers = TimerWheel()
+        self.ready_actions = collections.deque()
+        self.sampled_ticks = False
+        self.sampler = TickSampler()
+        # Ticking components taken out of the index by suspend(), mapped to
+        # the zone time at which they were suspended
+        self.suspended = {}
+        # Entities whose ticking components all stay suspended, including any
+        # added later (see set_dormant)
+        self.dormant = set()
+        self.suspend_dormant = False
+        self.elapsed = 0
+        # The part of a tick interval that ticks so far haven't accounted for
+        self._tick_remainder = 0
         self.tick_interval = 1
+        self.tick_seq = None
+        self.coalesce_ticks = True
+        self.tick_phases = 1
+        self.phase_budget = None
+        # Slices of the current tick's work that have yet to run, each a list
+        # of (class, components, dt)
+        self.pending_phases = collections.deque()
+        self.batch_size = 1
+        self.batch_time = None
+        self.merge_messages = False
+        self.outbox = None
+        self.stats = collections.Counter()
+        self.overload = None
+        self.command_queue = None
+        self.watchdog = None
+        self._recent_lag_ms = 0
+        self._deferred_ticks = 0
+        self._deferred_dt = 0
+        self.housekeeping_interval = 1
+        self.stats_interval = 60
+        self._next_housekeeping = 0
+        self._next_stats = 0
+        self._last_stats = collections.Counter()
         self.running = False
-        self.redis = None
+        self.transport = None
         self._max_id = 0
+        # IDs of the entities changed or destroyed since the last snapshot
+        self.dirty = set()
+        self.destroyed = set()
+        self.incremental_snapshots = False
+        self.compact_every = 10
+        self.snapshot_generation = 0
+        self.snapshot_deltas = 0
+        self.snapshot_frequency = None
+        self._next_snapshot = 0
+        # The forked process writing the current snapshot, if any, along with
+        # what the zone needs to know about it once it's done
+        self.snapshot_child = None
+        # In journal mode, everything since the last snapshot is also logged
+        # here (see figment.journal)
+        self.journal = None
+        self.replaying = False
+        self._journaling = False
 
     @classmethod
     def from_config(cls, id, world_path):
@@ -49,18 +143,6 @@ class Zone:
 
         return self
 
-    @property
-    def tick_key(self):
-        return "zone:%s:tick" % self.id
-
-    @property
-    def incoming_key(self):
-        return "zone:%s:incoming" % self.id
-
-    @staticmethod
-    def messages_key(entity_id):
-        return "entity:%s:messages" % entity_id
-
     def next_id(self):
         self._max_id += 1
         return self._max_id
@@ -91,8 +173,23 @@ class Zone:
         if self.id not in config["zones"]:
             fatal("Undefined zone '%s'" % self.id)
 
-        tick_interval = config["zones"][self.id].get("tick", 1)
-        self.tick_interval = tick_interval
+        zone_config = config["zones"][self.id]
+        self.tick_interval = zone_config.get("tick", 1)
+        self.coalesce_ticks = zone_config.get("coalesce_ticks", True)
+        self.sampled_ticks = zone_config.get("sampled_ticks", False)
+        self.suspend_dormant = zone_config.get("suspend_dormant", False)
+        self.tick_phases = max(1, zone_config.get("tick_phases", 1))
+        self.phase_budget = zone_config.get("phase_budget")
+        self.overload = configure(
+            OverloadController, zone_config.get("overload"), "overload"
+        )
+        self.command_queue = configure(
+            FairQueue, zone_config.get("fair_commands"), "fair_commands"
+        )
+        self.watchdog = configure(Watchdog, zone_config.get("watchdog"), "watchdog")
+        self.batch_size = max(1, zone_config.get("batch_size", 1))
+        self.batch_time = zone_config.get("batch_time")
+        self.merge_messages = zone_config.get("merge_messages", False)
 
         # TODO: per-zone persistence settings
 
@@ -100,14 +197,28 @@ class Zone:
         if not persistence:
             fatal("Unspecified persistence settings")
 
-        # TODO: alternate persistence modes
-
-        if not persistence["mode"] == "snapshot":
+        if persistence["mode"] not in ("snapshot", "journal"):
             fatal("Unrecognized persistence mode '%s'" % persistence["mode"])
 
+        self.incremental_snapshots = persistence.get("incremental", False)
+        self.compact_every = persistence.get("compact_every", 10)
+        self.snapshot_frequency = persistence.get("frequency")
+
         self.config = config
 
-        self.redis = Redis(config["redis"]["host"], config["redis"]["port"])
+        if self.snapshot_compression not in (None,) + snapshots.COMPRESSIONS:
+            fatal("Unrecognized compression '%s'" % persistence["compressed"])
+
+        if persistence["mode"] == "journal":
+            self.journal = Journal(
+                self.journal_path, persistence.get("sync_interval", 1)
+            )
+
+        transport_config = dict(config.get("redis") or {})
+        transport_name = transport_config.pop("transport", "redis")
+        if transport_name not in TRANSPORTS:
+            fatal("Unrecognized transport '%s'" % transport_name)
+        self.transport = TRANSPORTS[transport_name](self.id, transport_config)
 
         renderer_name = self.config["world"].get("renderer")
         if renderer_name:
@@ -124,55 +235,253 @@ class Zone:
             pass
         return os.path.join(self.world_path, os.path.expanduser(snapshot_path))
 
+    @property
+    def journal_path(self):
+        journal_path = self.config["persistence"].get("journal")
+        if not journal_path:
+            return self.snapshot_path + ".journal"
+        try:
+            journal_path = journal_path.format(id=self.id)
+        except TypeError:
+            pass
+        return os.path.join(self.world_path, os.path.expanduser(journal_path))
+
+    @property
+    def snapshot_compression(self):
+        compression = self.config["persistence"].get("compressed")
+        if compression is True:
+            return "zlib"
+        return compression or None
+
     @property
     def snapshot_serializer(self):
         extension = self.config["persistence"].get("format")
         if not extension:
             extension = os.path.splitext(self.snapshot_path)[1][1:]
-        return SERIALIZERS[extension]
+        return SNAPSHOT_SERIALIZERS[extension]
 
     def load_snapshot(self):
-        if not os.path.exists(self.snapshot_path):
-            return False
-
+        """
+        Load the latest snapshot, if there is one. In journal mode, anything
+        journaled since is then replayed on top of it.
+        """
+        loaded = os.path.exists(self.snapshot_path) and self.load_snapshot_files()
+
+        if self.journal is not None:
+            self.replay_journal()
+
+        return loaded
+
+    def load_snapshot_files(self):
+        """
+        Load the base image and its deltas in a single pass over the base,
+        one entity at a time. Components can refer to entities that haven't
+        been loaded yet, so they're only attached once every entity exists.
+        """
         log.info("Loading snapshot: %s" % self.snapshot_path)
-        with open(self.snapshot_path, "r") as f:
-            snapshot = f.read()
-            # if self.config['persistence'].get('compressed'):
-            #     snapshot = zlib.decompress(snapshot)
-            snapshot = self.snapshot_serializer.unserialize(snapshot)
+        serializer = self.snapshot_serializer
+
+        with snapshots.reading(self.snapshot_path) as f:
+            header, entity_dicts = serializer.load_snapshot(f)
+            self.snapshot_generation = header.get("generation", 0)
+
+            # Deltas are small, so what they override is read up front
+            delta_paths = snapshots.delta_paths(
+                self.snapshot_path, self.snapshot_generation
+            )
+            if delta_paths:
+                log.info("Applying %s delta(s)..." % len(delta_paths))
+            overrides, delta_header = snapshots.read_deltas(delta_paths, serializer)
+            self.snapshot_deltas = len(delta_paths)
+            if delta_header is not None:
+                header = delta_header
 
             log.info("Creating entities...")
 
-            for entity_dict in snapshot["entities"]:
-                entity = Entity.from_dict(
-                    {"id": entity_dict["id"], "hearing": entity_dict["hearing"]}, self
-                )
+            entities = []
+            for entity_dict in snapshots.apply_deltas(entity_dicts, overrides):
+                entity = Entity.from_dict(entity_dict, self, attach=False)
                 self._max_id = max(self._max_id, entity.id)
+                entities.append(entity)
 
-            log.info("Creating components...")
+        log.info("Attaching components...")
 
-            for entity_dict in snapshot["entities"]:
-                entity = self.get(entity_dict["id"])
-                entity.attach_from_dict(entity_dict)
+        for entity in entities:
+            entity.components.attach()
+
+        self.timers.load_list(header.get("timers", []))
+        self.load_actions(header.get("actions", []))
+        self.load_ticking(header.get("ticking"))
+        if self.journal is not None:
+            self.journal.seq = header.get("journal_seq") or 0
+
+        # Everything now matches what's on disk
+        self.dirty.clear()
+        self.destroyed.clear()
 
         return True
 
-    def save_snapshot(self):
-        log.info("Saving snapshot: %s" % self.snapshot_path)
+    def save_snapshot(self, full=False):
+        """
+        Save the zone from a forked child process. With incremental snapshots,
+        this only saves what changed since the last save, unless `full` is set
+        or it's time to compact the deltas into a new base image.
+
+        Only one snapshot is written at a time, so this first waits for the
+        last one to finish if it hasn't already.
+        """
+        if self.snapshot_child is not None:
+            self.reap_snapshot(block=True)
+
+        full = (
+            full
+            or not self.incremental_snapshots
+            or self.snapshot_deltas >= self.compact_every
+            or not os.path.exists(self.snapshot_path)
+        )
+
+        if full:
+            generation = self.snapshot_generation + 1
+            path = self.snapshot_path
+        else:
+            generation = self.snapshot_generation
+            path = snapshots.delta_path(
+                self.snapshot_path, generation, self.snapshot_deltas + 1
+            )
+
+        # The snapshot covers everything journaled so far, so new records go
+        # to a fresh segment and the older ones can go once it's written
+        journal_segment = None
+        if self.journal is not None:
+            journal_segment = self.journal.rotate()
+
+        log.info("Saving snapshot: %s" % path)
+        # The child reports how long the write itself took, since it's only
+        # reaped when housekeeping next gets around to it
+        timing_read, timing_write = os.pipe()
         child_pid = os.fork()
 
         if not child_pid:
-            f = tempfile.NamedTemporaryFile(delete=False)
-            snapshot = self.snapshot_serializer.serialize(
-                {"entities": [e.to_dict() for e in self.all()]}
+            status = os.EX_SOFTWARE
+            try:
+                os.close(timing_read)
+                started = monotonic()
+                if full:
+                    self.write_base(path, generation)
+                else:
+                    self.write_delta(path, generation)
+                if journal_segment is not None:
+                    self.journal.truncate(journal_segment)
+                os.write(timing_write, repr(monotonic() - started).encode())
+                status = os.EX_OK
+            except BaseException:
+                log.critical(traceback.format_exc())
+            finally:
+                os._exit(status)
+
+        os.close(timing_write)
+        self.snapshot_child = {
+            "pid": child_pid,
+            "path": path,
+            "timing": timing_read,
+            "started": monotonic(),
+            "generation": self.snapshot_generation,
+            "deltas": self.snapshot_deltas,
+            "dirty": self.dirty,
+            "destroyed": self.destroyed,
+        }
+
+        # The child has its own copy of these from before the fork
+        if full:
+            self.snapshot_generation = generation
+            self.snapshot_deltas = 0
+        else:
+            self.snapshot_deltas += 1
+        self.dirty = set()
+        self.destroyed = set()
+
+    def reap_snapshot(self, block=False):
+        """
+        Check on the process writing the current snapshot. Returns True if it
+        succeeded, False if it failed, or None if there's no snapshot being
+        written or (unless `block` is set) it's still going.
+
+        If it failed, whatever it was meant to save is marked as unsaved again,
+        so the next snapshot picks it up.
+        """
+        child = self.snapshot_child
+        if child is None:
+            return None
+
+        pid, status = os.waitpid(child["pid"], 0 if block else os.WNOHANG)
+        if not pid:
+            return None
+        self.snapshot_child = None
+
+        reaped = monotonic() - child["started"]
+        with os.fdopen(child["timing"], "rb") as timing:
+            written = timing.read()
+
+        if os.WIFEXITED(status) and os.WEXITSTATUS(status) == os.EX_OK:
+            log.info(
+                "Saved snapshot: %s (%s bytes, written in %.3fs, reaped after %.2fs)"
+                % (
+                    child["path"],
+                    os.path.getsize(child["path"]),
+                    float(written),
+                    reaped,
+                )
             )
-            # if self.config['persistence'].get('compressed'):
-            #     snapshot = zlib.compress(snapshot)
-            f.write(snapshot)
-            f.close()
-            shutil.move(f.name, self.snapshot_path)
-            os._exit(os.EX_OK)
+            return True
+
+        log.error(
+            "Failed to save snapshot: %s (status %s, reaped after %.2fs)"
+            % (child["path"], status, reaped)
+        )
+        self.snapshot_generation = child["generation"]
+        self.snapshot_deltas = child["deltas"]
+        self.dirty |= child["dirty"]
+        self.destroyed |= child["destroyed"] - self.entities.keys()
+        return False
+
+    def write_base(self, path, generation):
+        snapshots.write(
+            path,
+            self.snapshot_serializer,
+            {
+                "generation": generation,
+                "entities": (e.to_dict() for e in self.all()),
+                "timers": self.timers.to_list(),
+                "actions": self.actions_to_list(),
+                "ticking": self.ticking_to_dict() if self.journal else None,
+                "journal_seq": self.journal.seq if self.journal else None,
+            },
+            self.snapshot_compression,
+        )
+
+        # Deltas from older bases are obsolete now that this one is in place
+        for path in snapshots.delta_paths(self.snapshot_path):
+            os.unlink(path)
+
+    def write_delta(self, path, generation):
+        snapshots.write(
+            path,
+            self.snapshot_serializer,
+            {
+                "generation": generation,
+                "entities": (
+                    self.entities[id].to_dict()
+                    for id in self.dirty
+                    if id in self.entities
+                ),
+                "destroyed": list(self.destroyed),
+                "timers": self.timers.to_list(),
+                "actions": self.actions_to_list(),
+                "ticking": self.ticking_to_dict() if self.journal else None,
+                "journal_seq": self.journal.seq if self.journal else None,
+            },
+            self.snapshot_compression,
+        )
 
     def _import_subclasses(self, module_name, parent_class):
         module = importlib.import_module(module_name)
@@ -197,75 +506,870 @@ class Zone:
 
     def start(self):
         try:
-            self.redis.ping()
-        except ConnectionError as e:
-            fatal("Redis error: %s" % e.message)
+            self.transport.ping()
+        except TransportError as e:
+            fatal(str(e))
 
         self.running = True
         log.info("Listening.")
 
         # Clear any existing tick events
-        self.redis.ltrim(self.tick_key, 0, 0)
+        self.transport.clear_ticks()
+
+        if self.watchdog is not None:
+            self.watchdog.start()
+
+        # Nothing outside this process can reach an in-process transport, so
+        # the zone has to drive its own ticks
+        if self.transport.in_process:
+            threading.Thread(target=self.start_ticker, daemon=True).start()
+
         try:
             while self.running:
                 self.process_one_event()
+                self.housekeeping()
         except Exception as e:
             log.critical(traceback.format_exc())
         except BaseException as e:
             pass
         finally:
+            if self.watchdog is not None:
+                self.watchdog.stop()
+            if self.command_queue is not None:
+                self.transport.requeue(self.command_queue.drain())
             self.save_snapshot()
+            self.reap_snapshot(block=True)
 
     def stop(self):
         self.running = False
 
+    def housekeeping(self):
+        """Periodic upkeep that runs between events."""
+        now = monotonic()
+        if now < self._next_housekeeping:
+            return
+        self._next_housekeeping = now + self.housekeeping_interval
+
+        if self.journal is not None:
+            self.journal.sync()
+
+        self.reap_snapshot()
+        if self.snapshot_frequency:
+            if not self._next_snapshot:
+                self._next_snapshot = now + self.snapshot_frequency
+            elif now >= self._next_snapshot and self.snapshot_child is None:
+                self._next_snapshot = now + self.snapshot_frequency
+                self.save_snapshot()
+
+        if self.overload is not None:
+            self.stats["overload_level"] = self.overload.check(
+                self.backlog(), self._recent_lag_ms
+            )
+            self._recent_lag_ms = 0
+
+        if now >= self._next_stats:
+            self._next_stats = now + self.stats_interval
+            if self.stats != self._last_stats:
+                log.debug(
+                    "Stats: %s"
+                    % ", ".join("%s=%s" % item for item in sorted(self.stats.items()))
+                )
+                self._last_stats = self.stats.copy()
+
+    def backlog(self):
+        """Return how many commands are waiting, or None if it can't be known."""
+        return self.transport.backlog()
+
     def start_ticker(self):
         log.info("Ticking every %ss." % self.tick_interval)
-        tock = False
+        clock = TickClock(self.tick_interval)
         while True:
-            log.debug("Tock." if tock else "Tick.")
-            # TODO: timestamp here instead of 1, for debugging?
-            self.redis.rpush(self.tick_key, 1)
-            sleep(self.tick_interval)
-            tock = not tock
+            sleep(clock.delay())
+            payload = clock.next_tick()
+            log.debug("Tick %s." % payload)
+            self.transport.push_tick(payload)
 
     def send_message(self, entity_id, message):
-        self.redis.publish(self.messages_key(entity_id), message)
+        # Whoever heard these the first time around has already seen them
+        if self.replaying:
+            return
+
+        if self.outbox is None:
+            self.publish([(entity_id, message)])
+        else:
+            self.outbox.append((entity_id, message))
+
+    def publish(self, messages):
+        self.transport.publish(messages)
+
+    def flush_outbox(self):
+        """Publish every message collected during the current event at once."""
+        outbox = self.take_outbox()
+        if outbox:
+            self.publish(outbox)
+
+    def take_outbox(self):
+        outbox, self.outbox = self.outbox, None
+        if not outbox:
+            return []
+
+        self.stats["messages"] += len(outbox)
+
+        if self.merge_messages:
+            messages_by_entity_id = {}
+            for entity_id, message in outbox:
+                messages_by_entity_id.setdefault(entity_id, []).append(message)
+            outbox = [
+                (entity_id, self.merge(messages))
+                for entity_id, messages in messages_by_entity_id.items()
+            ]
+
+        return outbox
+
+    @staticmethod
+    def merge(messages):
+        if len(messages) == 1:
+            return messages[0]
+        return '{"type": "batch", "messages": [%s]}' % ", ".join(messages)
+
+    @staticmethod
+    def unmerge(message):
+        """Split a published payload back into individual messages."""
+        if isinstance(message, dict) and message.get("type") == "batch":
+            return message["messages"]
+        return [message]
 
     def listen(self, entity_id):
-        subscription = self.subscribe(entity_id)
-        for message in subscription.listen():
-            yield message["data"]
+        return self.subscribe(entity_id).listen()
 
-    # TODO: Leaky abstraction :\
     def subscribe(self, entity_id):
-        subscription = self.redis.pubsub(ignore_subscribe_messages=True)
-        subscription.subscribe(self.messages_key(entity_id))
-        return subscription
+        return self.transport.subscribe(entity_id)
+
+    def receive_events(self, timeout=None):
+        """
+        Block until at least one tick or command is queued, then take up to
+        `receive_count` queued events in a single round trip. Returns nothing
+        if `timeout` (by default the housekeeping interval) passes first.
+
+        While the fair command queue's window is full, only ticks are taken,
+        and commands are left in the transport.
+        """
+        if timeout is None:
+            timeout = self.housekeeping_interval
+
+        count = self.receive_count()
+        if count:
+            events = self.transport.receive(count, timeout)
+        else:
+            events = self.transport.drain_ticks()
+            if not events:
+                sleep(min(timeout, self.tick_interval))
+
+        if self.coalesce_ticks and any(kind == TICK for kind, _ in events):
+            events, absorbed = self.merge_tick_events(
+                events + self.transport.drain_ticks()
+            )
+            self.transport.ack(absorbed)
+
+        return events
+
+    def merge_tick_events(self, events):
+        """
+        Collapse every tick among `events` into the first one, which then
+        covers their combined dt. Ticks always precede commands in a batch,
+        so this doesn't reorder anything. Returns the new events and the tick
+        events that were absorbed.
+        """
+        ticks = [event for event in events if event[0] == TICK]
+        if len(ticks) < 2:
+            return events, []
+
+        first, absorbed = ticks[0], ticks[1:]
+        merged = Event(
+            TICK,
+            merge_ticks([value for _, value in ticks], self.tick_interval),
+            id=getattr(first, "id", None),
+            queued_at=getattr(first, "queued_at", None),
+        )
+
+        self.stats["ticks_coalesced"] += len(absorbed)
+        log.debug("Coalesced %s backlogged tick(s)." % len(ticks))
+
+        return [merged] + [event for event in events if event[0] != TICK], absorbed
+
+    def requeue_events(self, events):
+        """Put unprocessed events back at the front of their queues."""
+        events = self.return_commands(events)
+        if events:
+            self.transport.requeue(events)
+
+    def receive_count(self):
+        """
+        Return how many events to take from the transport at once, which is
+        none at all once the fair command queue holds `window` commands.
+        """
+        if self.command_queue is None:
+            return self.batch_size
+        return max(0, self.command_queue.window - len(self.command_queue))
+
+    def receive_timeout(self):
+        """
+        Return how long to wait for new events before there is other work to
+        do, or None if there isn't any.
+        """
+        timeouts = []
+
+        # While a tick is spread over phases, don't let an idle queue hold
+        # up the rest of it
+        if self.pending_phases:
+            timeouts.append(self.phase_interval)
+
+        if self.command_queue is not None:
+            wait = self.command_queue.wait_time()
+            if wait is not None:
+                timeouts.append(wait)
+
+        if self.ready_actions:
+            timeouts.append(0)
+
+        return min(timeouts) if timeouts else None
 
     def process_one_event(self):
-        key, value = self.redis.blpop([self.tick_key, self.incoming_key])
+        timeout = self.receive_timeout()
+        if timeout is not None:
+            timeout = min(timeout, self.housekeeping_interval)
+
+        events = self.receive_events(timeout)
+        if not events and self.pending_phases:
+            self.run_phase()
+
+        if self.command_queue is not None:
+            events, dropped = self.take_commands(events)
+            self.transport.ack(dropped)
+
+        leftover = self.process_events(events)
+        self.transport.ack(events[: len(events) - len(leftover)])
+        if leftover:
+            self.requeue_events(leftover)
+
+        self.run_ready_actions()
+
+    def take_commands(self, events):
+        """
+        Move received commands into the per-entity queues, and return the
+        received ticks followed by up to `batch_size` commands taken fairly
+        from them, along with any commands dropped because their entity's
+        queue was full.
+        """
+        ticks = [event for event in events if event[0] == TICK]
+        overflow = []
+
+        for event in events:
+            if event[0] != TICK:
+                entity_id, _, command = event[1].partition(" ")
+                if not self.command_queue.push(int(entity_id), event):
+                    overflow.append(event)
+                    self.shed_command(
+                        int(entity_id),
+                        command,
+                        "You're sending commands too quickly; some were ignored.",
+                    )
+
+        commands = []
+        while len(commands) < self.batch_size:
+            event = self.command_queue.pop()
+            if event is None:
+                break
+            commands.append(event)
+
+        return ticks + commands, overflow
+
+    def return_commands(self, events):
+        """
+        Put commands that were taken from the per-entity queues but not
+        processed back where they came from, and return the other events.
+        """
+        if self.command_queue is None:
+            return events
+
+        for event in reversed(events):
+            if event[0] != TICK:
+                self.command_queue.requeue(int(event[1].partition(" ")[0]), event)
+        return [event for event in events if event[0] == TICK]
+
+    def process_events(self, events):
+        """
+        Process a batch of events in order, returning any that were left over
+        because `batch_time` ran out.
+        """
+        self.measure_lag(events)
+
+        deadline = None
+        if self.batch_time:
+            deadline = monotonic() + self.batch_time
+
+        for index, (kind, value) in enumerate(events):
+            if index and deadline is not None and monotonic() > deadline:
+                log.debug(
+                    "Batch time exceeded, requeueing %s event(s)."
+                    % (len(events) - index)
+                )
+                return events[index:]
+            self.process_event(kind, value)
+
+            # Commands take turns with the phases of a spread tick
+            if kind != TICK and self.pending_phases:
+                self.run_phase()
+
+        return []
+
+    def measure_lag(self, events):
+        """Record how long the oldest event in a batch waited in its queue."""
+        queued_at = [
+            event.queued_at
+            for event in events
+            if getattr(event, "queued_at", None) is not None
+        ]
+        if queued_at:
+            self.stats["lag_ms"] = int((time() - min(queued_at)) * 1000)
+            self._recent_lag_ms = max(self._recent_lag_ms, self.stats["lag_ms"])
+
+    def process_event(self, kind, value):
+        self.outbox = []
+        try:
+            if kind == TICK:
+                self.stats["ticks"] += 1
+                seq, dt = parse_tick(value)
+                if seq is not None:
+                    if self.tick_seq is not None and seq > self.tick_seq + 1:
+                        self.stats["ticks_skipped"] += seq - self.tick_seq - 1
+                    self.tick_seq = seq
+                with self.watching(tick=value):
+                    self.perform_tick(dt)
+            else:
+                self.stats["commands"] += 1
+                entity_id, _, command = value.partition(" ")
+                entity_id = int(entity_id)
+                with self.watching(entity_id=entity_id, command=command):
+                    if self.overload is None or self.overload.admit(entity_id):
+                        self.perform_command(entity_id, command)
+                    else:
+                        self.shed_command(entity_id, command)
+        finally:
+            self.flush_outbox()
 
-        if key.decode("utf-8") == self.tick_key:
-            self.perform_tick()
-        else:
-            entity_id, _, command = value.decode("utf-8").partition(" ")
-            self.perform_command(int(entity_id), command)
+    @contextlib.contextmanager
+    def watching(self, **context):
+        """Let the watchdog (if any) know what the zone is busy with."""
+        if self.watchdog is None:
+            yield
+            return
+
+        self.watchdog.begin(**context)
+        try:
+            yield
+        finally:
+            if self.watchdog.end() is not None:
+                self.stats["slow_events"] += 1
 
     def enqueue_command(self, entity_id, command):
-        self.redis.rpush(self.incoming_key, " ".join([str(entity_id), command]))
+        self.transport.enqueue_command(entity_id, command)
 
     def perform_command(self, entity_id, command):
+        with self.journaling("C", [entity_id, command]):
+            entity = self.get(entity_id)
+            log.debug("Processing: [%s] %s" % (entity.id, command))
+            entity.perform(command)
+
+    def shed_command(
+        self,
+        entity_id,
+        command,
+        reason="The world is busy right now. Please slow down.",
+    ):
+        self.stats["commands_shed"] += 1
+        log.debug("Shedding: [%s] %s" % (entity_id, command))
         entity = self.get(entity_id)
-        log.debug("Processing: [%s] %s" % (entity.id, command))
-        entity.perform(command)
+        if entity is not None:
+            entity.tell(reason)
+
+    def perform_tick(self, dt=None):
+        if dt is None:
+            dt = self.tick_interval
+
+        # Under load, ticks are saved up and run together less often
+        if self.overload is not None and self.overload.overloaded:
+            self._deferred_ticks += 1
+            self._deferred_dt += dt
+            if self._deferred_ticks < self.overload.tick_stride:
+                self.stats["ticks_deferred"] += 1
+                return
+            dt = self._deferred_dt
+            self._deferred_ticks = self._deferred_dt = 0
+        elif self._deferred_ticks:
+            # Load eased with ticks still saved up
+            dt += self._deferred_dt
+            self._deferred_ticks = self._deferred_dt = 0
+
+        shedding = self.overload is not None and self.overload.overloaded
+        with self.journaling("T", [dt, shedding]):
+            self.run_tick(dt, shedding)
+
+        # The first phase of a spread tick is journaled on its own, since how
+        # much of it runs depends on the time it takes
+        if self.pending_phases:
+            self.run_phase()
+
+    def run_tick(self, dt, shedding=False):
+        self.elapsed += dt
+
+        # A coalesced tick stands in for several, and timers and sampled
+        # components expect to see every one of them. Ticks also arrive
+        # unevenly, so any part of an interval left over carries over to the
+        # next tick rather than being rounded away.
+        ticks = self._tick_remainder + dt / self.tick_interval
+        whole_ticks = int(ticks + 1e-9)
+        self._tick_remainder = max(0, ticks - whole_ticks)
+        ticks = whole_ticks
+        fire(self.timers.advance(ticks), self)
+        for timer in self.action_timers.advance(ticks):
+            self.continue_action(timer.callback)
+
+        # Whatever is left of the last tick has to run before this one
+        while self.pending_phases:
+            self.run_phase(finish=True)
+
+        # Ticks may add or remove components, so each class gets a copy
+        work = []
+        for bucket in list(self.tick_buckets.values()):
+            bucket_dt = bucket.advance(ticks, dt)
+            if bucket_dt is None:
+                continue
+            for cls in list(bucket.classes):
+                components = self.ticking_components.get(cls)
+                if not components:
+                    continue
+                if shedding and cls.sheddable:
+                    self.stats["ticks_shed"] += len(components)
+                    continue
+                work.append((cls, list(components), bucket_dt))
+
+        if self.tick_phases == 1:
+            for cls, components, dt in work:
+                cls.tick_batch(components, dt)
+        else:
+            self.pending_phases.extend(
+                [
+                    (cls, components[phase :: self.tick_phases], dt)
+                    for cls, components, dt in work
+                    if components[phase :: self.tick_phases]
+                ]
+                for phase in range(self.tick_phases)
+            )
+
+        for component in self.sampler.advance(ticks):
+            if shedding and component.sheddable:
+                self.stats["ticks_shed"] += 1
+            elif component in self.sampler:
+                # Like an unsampled tick, an act covers at least a whole period
+                period = max(1, component.tick_every)
+                component.act(dt * max(period, ticks) / ticks)
+            # Acting may have detached it; otherwise draw its next turn
+            if component in self.sampler:
+                self.sampler.add(component)
 
-    def perform_tick(self):
-        for entity in self.ticking_entities:
-            # TODO: Somehow iterate over only ticking components
+    @property
+    def phase_interval(self):
+        """How long an idle zone waits between the phases of a spread tick."""
+        return self.tick_interval / self.tick_phases
+
+    def run_phase(self, classes=None, finish=False):
+        """
+        Run the next slice of a tick spread over `tick_phases` phases. If it
+        takes longer than `phase_budget` seconds, whatever classes remain are
+        put off until the next phase, unless `finish` is set. The number of
+        classes that did run is journaled, and when replaying, `classes` is
+        that number.
+        """
+        with self.journaling("P") as record:
+            # Components may have been removed or suspended since the tick began
+            work = []
+            for cls, components, dt in self.pending_phases.popleft():
+                live = self.ticking_components.get(cls, {})
+                work.append((cls, [c for c in components if c in live], dt))
+
+            with self.collecting_messages():
+                record[1] = self.run_phase_work(work, classes, finish)
+
+    def run_phase_work(self, work, classes=None, finish=False):
+        """Tick the classes in `work`, returning how many of them were ticked."""
+        deadline = None
+        if self.phase_budget and not (finish or self.replaying):
+            deadline = monotonic() + self.phase_budget
+
+        for index, (cls, components, dt) in enumerate(work):
+            if index and (
+                index == classes or (deadline is not None and monotonic() > deadline)
+            ):
+                self.stats["phases_overrun"] += 1
+                if self.pending_phases:
+                    self.pending_phases[0] = work[index:] + self.pending_phases[0]
+                else:
+                    self.pending_phases.append(work[index:])
+                return index
+            cls.tick_batch(components, dt)
+
+        return len(work)
+
+    @contextlib.contextmanager
+    def collecting_messages(self):
+        """Collect messages sent outside of any event into one outbox."""
+        if self.outbox is not None:
+            yield
+            return
+
+        self.outbox = []
+        try:
+            yield
+        finally:
+            self.flush_outbox()
+
+    def perform_action(self, function, entity, **kwargs):
+        """
+        Call `function(entity, **kwargs)`. If it turns out to be a generator,
+        run it until it first yields and resume it later (see figment.actions).
+        """
+        if self.watchdog is not None:
+            self.watchdog.tag(action=function.__name__)
+
+        generator = function(entity, **kwargs)
+        if inspect.isgenerator(generator):
+            # Fail now, rather than when the action is saved in a snapshot
+            callback_to_dict(function)
+            self.continue_action(Action(function, entity, kwargs, generator))
+
+    def continue_action(self, action):
+        if action.entity.zone is not self:
+            return
+
+        ticks = action.step()
+        if ticks is not None:
+            self.defer_action(action, ticks)
+
+    def defer_action(self, action, ticks):
+        if ticks:
+            self.action_timers.schedule(ticks, action)
+        else:
+            self.ready_actions.append(action)
+
+    def run_ready_actions(self):
+        """Resume every action that was ready before this was called."""
+        if not self.ready_actions:
+            return
+
+        with self.journaling("R"):
+            for _ in range(len(self.ready_actions)):
+                action = self.ready_actions.popleft()
+                with self.collecting_messages(), self.watching(
+                    entity_id=action.entity.id, action=action.function.__name__
+                ):
+                    self.continue_action(action)
+
+    @contextlib.contextmanager
+    def journaling(self, kind, data=None, seed=None):
+        """
+        Journal something the zone does, and seed the random number generator
+        for it, so that replaying the journal does the same thing. Anything it
+        does in turn (like a tick catching up on the last one's phases) is
+        part of the same record.
+
+        Live records get a fresh seed from the OS, which is journaled along
+        with them, so rolls can't be predicted; when replaying, `seed` is the
+        journaled one.
+
+        This yields the record as a [kind, data, seed] list, whose data can be
+        filled in with whatever only turns out along the way. It's journaled
+        once that's done.
+        """
+        record = [kind, data, seed]
+        if self.journal is None or self._journaling:
+            yield record
+            return
+
+        if not self.replaying:
+            record[2] = int.from_bytes(os.urandom(8), "big")
+        elif seed is None:
+            # Journaled before records kept their seeds
+            record[2] = "%s:%s" % (self.id, self.journal.seq)
+        random.seed(record[2])
+        # Components may roll dice in bulk with NumPy instead
+        numpy = sys.modules.get("numpy")
+        if numpy is not None:
+            numpy.random.seed(random.getrandbits(32))
+
+        self._journaling = True
+        try:
+            yield record
+        finally:
+            self._journaling = False
+            if not self.replaying:
+                self.journal.append(*record)
+
+    def replay_journal(self):
+        """Redo everything journaled after the loaded snapshot."""
+        replayed = 0
+        self.replaying = True
+        try:
+            for seq, kind, data, seed in self.journal.read(after=self.journal.seq):
+                self.journal.seq = seq
+                try:
+                    with self.journaling(kind, data, seed):
+                        self.replay_record(kind, data)
+                except Exception:
+                    log.error(traceback.format_exc())
+                replayed += 1
+        finally:
+            self.replaying = False
+
+        if replayed:
+            log.info("Replayed %s journal record(s)." % replayed)
+
+    def replay_record(self, kind, data):
+        if kind == "C":
+            self.perform_command(*data)
+        elif kind == "T":
+            # Older journals only have the dt
+            self.run_tick(*(data if isinstance(data, list) else [data]))
+        elif kind == "P":
+            if self.pending_phases:
+                self.run_phase(data)
+        elif kind == "R":
+            self.run_ready_actions()
+
+    def actions_to_list(self):
+        return [
+            dict(timer["callback"].to_dict(), ticks=timer["ticks"])
+            for timer in self.action_timers.to_list()
+        ] + [dict(action.to_dict(), ticks=0) for action in self.ready_actions]
+
+    def load_actions(self, actions):
+        for action_dict in actions:
+            action = Action.from_dict(action_dict, self)
+            if action is not None:
+                self.defer_action(action, action_dict["ticks"])
+
+    def ticking_to_dict(self):
+        """
+        Return the tick state that snapshots need in journal mode, so that
+        replaying the journal on top of them ticks the same way as the zone
+        did: the time and ticks counted so far, when each sampled component
+        acts next, which components are suspended, and what's left of a
+        spread tick. Ticking components are listed in the order they tick in.
+        The journal starts over with every snapshot, so deltas need this as
+        much as base images do.
+        """
+
+        def ref(component):
+            return [component.entity.id, component.__class__.__name__]
+
+        return {
+            "elapsed": self.elapsed,
+            "remainder": self._tick_remainder,
+            "deferred": [self._deferred_ticks, self._deferred_dt],
+            "buckets": [
+                [period, bucket.ticks, bucket.dt]
+                for period, bucket in self.tick_buckets.items()
+            ],
+            "components": [
+                [cls.__name__, [component.entity.id for component in components]]
+                for cls, components in self.ticking_components.items()
+            ],
+            "sampler": {
+                "now": self.sampler.now,
+                "turns": [ref(c) + [due] for c, due in self.sampler.to_list()],
+            },
+            "suspended": [ref(c) + [since] for c, since in self.suspended.items()],
+            "phases": [
+                [
+                    [
+                        cls.__name__,
+                        [
+                            component.entity.id
+                            for component in components
+                            if component in self.ticking_components.get(cls, {})
+                        ],
+                        dt,
+                    ]
+                    for cls, components, dt in work
+                ]
+                for work in self.pending_phases
+            ],
+        }
+
+    def load_ticking(self, state):
+        """Restore the tick state saved by ticking_to_dict()."""
+        if state is None:
+            return
+
+        def component(entity_id, name):
+            entity = self.get(entity_id)
+            if entity is None or not entity.is_(name):
+                return None
+            return getattr(entity, name)
+
+        self.elapsed = state["elapsed"]
+        self._tick_remainder = state["remainder"]
+        self._deferred_ticks, self._deferred_dt = state["deferred"]
+
+        for entity_id, name, since in state["suspended"]:
+            suspended = component(entity_id, name)
+            if suspended is not None:
+                self.suspend(suspended)
+                self.suspended[suspended] = since
+
+        # Attaching the entities tracked their components in whatever order
+        # they were loaded in
+        ticking = {}
+        for name, entity_ids in state["components"]:
+            for entity_id in entity_ids:
+                found = component(entity_id, name)
+                if found is not None and found in self.ticking_components.get(
+                    found.__class__, {}
+                ):
+                    ticking.setdefault(found.__class__, {})[found] = None
+        for cls, components in self.ticking_components.items():
+            for found in components:
+                ticking.setdefault(cls, {})[found] = None
+        self.ticking_components = ticking
+
+        buckets = {}
+        for period, ticks, dt in state["buckets"]:
+            bucket = self.tick_buckets.get(period) or TickBucket(period)
+            bucket.ticks, bucket.dt = ticks, dt
+            buckets[period] = bucket
+        buckets.update(
+            (period, bucket)
+            for period, bucket in self.tick_buckets.items()
+            if period not in buckets
+        )
+        self.tick_buckets = buckets
+        for bucket in buckets.values():
+            bucket.classes = {cls: None for cls in ticking if cls in bucket.classes}
+
+        turns = []
+        for entity_id, name, due in state["sampler"]["turns"]:
+            found = component(entity_id, name)
+            if found is not None:
+                turns.append((found, due))
+        self.sampler.load_list(state["sampler"]["now"], turns)
+
+        for work in state["phases"]:
+            phase = []
+            for name, entity_ids, dt in work:
+                cls = self.components.get(name)
+                if cls is None:
+                    continue
+                components = [component(entity_id, name) for entity_id in entity_ids]
+                phase.append((cls, [c for c in components if c is not None], dt))
+            self.pending_phases.append(phase)
+
+    def schedule(self, delay, callback, *args):
+        """
+        Call `callback(*args)` on the first tick at least `delay` seconds from
+        now. The callback must be a component method or a module-level
+        function (see figment.timers), and `args` must be serializable so the
+        timer can be saved in snapshots. Returns a Timer that can be cancelled.
+        """
+        ticks = math.ceil(delay / self.tick_interval)
+        return self.timers.schedule(ticks, callback_to_dict(callback), args)
+
+    def track_ticking(self, component):
+        if not component.ticking:
+            return
+
+        if self.dormant and getattr(component, "entity", None) in self.dormant:
+            self.suspended.setdefault(component, self.elapsed)
+            return
+
+        if self.sampled_ticks and component.tick_chance is not None:
+            self.sampler.add(component)
+        else:
+            cls = component.__class__
+            if cls not in self.ticking_components:
+                self.ticking_components[cls] = {}
+                period = max(1, cls.tick_every)
+                if period not in self.tick_buckets:
+                    self.tick_buckets[period] = TickBucket(period)
+                self.tick_buckets[period].classes[cls] = None
+            self.ticking_components[cls][component] = None
+
+    def resample(self, component):
+        """
+        Redraw a sampled component's next turn if its tick_chance has changed
+        since the last one was drawn. Components call this whenever one of
+        their attributes is assigned to.
+        """
+        if component not in self.sampler:
+            return
+        if self.sampler.chances[component] != component.tick_chance:
+            self.sampler.add(component)
+
+    def untrack_ticking(self, component):
+        self.sampler.remove(component)
+        self.suspended.pop(component, None)
+
+        components = self.ticking_components.get(component.__class__)
+        if components is not None:
+            components.pop(component, None)
+            if not components:
+                del self.ticking_components[component.__class__]
+                self.tick_buckets[max(1, component.tick_every)].classes.pop(
+                    component.__class__
+                )
+
+    def suspend(self, component):
+        """
+        Stop ticking a component until it is resumed. Worlds use this to skip
+        the parts of the zone nobody is around to see (see `suspend_dormant`).
+        """
+        if component.ticking and component not in self.suspended:
+            self.untrack_ticking(component)
+            self.suspended[component] = self.elapsed
+
+    def resume(self, component):
+        """Start ticking a suspended component again, catching it up first."""
+        since = self.suspended.pop(component, None)
+        if since is None:
+            return
+
+        self.track_ticking(component)
+        if self.elapsed > since:
+            component.catch_up(self.elapsed - since)
+
+    def set_dormant(self, entity, dormant):
+        """
+        Suspend or resume all of an entity's ticking components. Ticking
+        components added to a dormant entity start out suspended.
+        """
+        if dormant:
+            self.dormant.add(entity)
             for component in entity.components:
-                if component.ticking:
-                    component.tick()
+                self.suspend(component)
+        else:
+            self.dormant.discard(entity)
+            for component in list(entity.components):
+                self.resume(component)
+
+    def ticking_counts(self):
+        """Return the number of live ticking components of each class."""
+        counts = collections.Counter(
+            {
+                cls.__name__: len(components)
+                for cls, components in self.ticking_components.items()
+            }
+        )
+        counts.update(component.__class__.__name__ for component in self.sampler)
+        return dict(counts)
 
     # Entity helpers
 
@@ -289,17 +1393,33 @@ class Zone:
 
     def clone(self, entity):
         # TODO FIXME: This is fairly awful
-        return Entity.from_dict(entity.to_dict(), self)
+        return Entity.from_dict(dict(entity.to_dict(), id=None), self)
 
     def destroy(self, entity):
         entity.components.purge()
         self.remove(entity)
 
     def add(self, entity):
-        entity.id = self.next_id()
+        # Entities loaded from a snapshot keep the IDs they were saved with
+        if entity.id is None:
+            entity.id = self.next_id()
+        else:
+            self._max_id = max(self._max_id, entity.id)
         entity.zone = self
         self.entities[entity.id] = entity
+        self.mark_dirty(entity)
+        for component in entity.components:
+            self.track_ticking(component)
 
     def remove(self, entity):
         self.entities.pop(entity.id)
+        self.dormant.discard(entity)
+        for component in entity.components:
+            self.untrack_ticking(component)
         entity.zone = None
+        self.dirty.discard(entity.id)
+        self.destroyed.add(entity.id)
+
+    def mark_dirty(self, entity):
+        self.dirty.add(entity.id)
+        self.destroyed.discard(entity.id)
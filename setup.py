@@ -16,6 +16,7 @@ during runtime, they can be dynamically applied to Entities (that's the whole
 point, after all!) so you can even do a good chunk of worldbuilding from within
 the world itself.
 """
+
 from setuptools import setup
 
 setup(
@@ -39,7 +40,7 @@ setup(
         "Topic :: Games/Entertainment :: Multi-User Dungeons (MUD)",
         "Topic :: Games/Entertainment",
     ],
-    install_requires=["redis==3.3.11", "termcolor==1.1.0"],
-    extras_require={"YAML": "PyYAML==5.1.2"},
+    install_requires=["redis>=4.2", "termcolor==1.1.0"],
+    extras_require={"YAML": "PyYAML==5.1.2", "msgpack": "msgpack>=1.0"},
     entry_points={"console_scripts": ["figment = figment.cli:cli"]},
 )
@@ -70,7 +70,7 @@ class Mooing(Component):
 
     ticking = True
 
-    def tick(self):
+    def tick(self, dt):
         for entity in self.entity.zone.all():
             entity.tell("Moo!")
 
@@ -0,0 +1,404 @@
+import asyncio
+import time
+
+import pytest
+from redis.exceptions import ResponseError
+
+from figment.transport import RedisStreamsTransport, TICK, COMMAND
+from figment.aio import AsyncRedisStreamsTransport
+
+#############################################################################
+# A stand-in for the parts of Redis that the streams transport uses
+#############################################################################
+
+
+def parse_id(entry_id):
+    ms, _, seq = entry_id.partition(b"-")
+    return int(ms), int(seq or 0)
+
+
+class StubPipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.calls = []
+
+    def __getattr__(self, name):
+        def call(*args, **kwargs):
+            self.calls.append((name, args, kwargs))
+
+        return call
+
+    def execute(self):
+        calls, self.calls = self.calls, []
+        return [
+            getattr(self.redis, name)(*args, **kwargs) for name, args, kwargs in calls
+        ]
+
+
+class StubRedis:
+    """
+    Streams and consumer groups, kept in memory. Entries are numbered from 1,
+    each a millisecond after the last, and XREADGROUP never blocks: it
+    returns None at once where Redis would have waited.
+    """
+
+    def __init__(self):
+        self.streams = {}
+        self.groups = {}
+        self.last_id = 0
+        self.reads = []
+        # How far this server's clock is ahead of the zone's
+        self.skew = 0
+
+    def xadd(self, key, fields, maxlen=None, approximate=True):
+        self.last_id += 1
+        entry_id = b"%d-0" % self.last_id
+        self.streams.setdefault(key, {})[entry_id] = {
+            name.encode("utf-8"): value.encode("utf-8")
+            for name, value in fields.items()
+        }
+        return entry_id
+
+    def time(self):
+        now = time.time() + self.skew
+        return int(now), int(now % 1 * 1e6)
+
+    def xlen(self, key):
+        return len(self.streams.get(key, {}))
+
+    def xgroup_create(self, key, group, id="$", mkstream=False):
+        if (key, group) in self.groups:
+            raise ResponseError("BUSYGROUP Consumer Group name already exists")
+        stream = self.streams.setdefault(key, {})
+        last = max(stream, key=parse_id) if id == "$" and stream else b"0-0"
+        self.groups[key, group] = {"last": last, "pending": {}}
+
+    def xgroup_setid(self, key, group, id):
+        stream = self.streams.get(key, {})
+        self.groups[key, group]["last"] = (
+            max(stream, key=parse_id) if stream else b"0-0"
+        )
+
+    def xreadgroup(self, groupname, consumername, streams, count=None, block=None):
+        self.reads.append((dict(streams), block))
+        response = []
+
+        for key, start in streams.items():
+            group = self.groups[key, groupname]
+            stream = self.streams.get(key, {})
+
+            if start == ">":
+                entry_ids = [
+                    entry_id
+                    for entry_id in sorted(stream, key=parse_id)
+                    if parse_id(entry_id) > parse_id(group["last"])
+                ][:count]
+                for entry_id in entry_ids:
+                    group["pending"][entry_id] = consumername
+                    group["last"] = entry_id
+                entries = [(entry_id, stream[entry_id]) for entry_id in entry_ids]
+                if entries:
+                    response.append([key.encode("utf-8"), entries])
+            else:
+                start = parse_id(
+                    start.encode("utf-8") if isinstance(start, str) else start
+                )
+                entries = [
+                    (entry_id, stream.get(entry_id, {}))
+                    for entry_id, consumer in sorted(
+                        group["pending"].items(), key=lambda item: parse_id(item[0])
+                    )
+                    if consumer == consumername and parse_id(entry_id) > start
+                ][:count]
+                response.append([key.encode("utf-8"), entries])
+
+        # Reads of new entries come back empty only once they've timed out
+        if not response and all(start == ">" for start in streams.values()):
+            return None
+        return response
+
+    def xack(self, key, group, *entry_ids):
+        pending = self.groups[key, group]["pending"]
+        return sum(pending.pop(entry_id, None) is not None for entry_id in entry_ids)
+
+    def xdel(self, key, *entry_ids):
+        stream = self.streams.get(key, {})
+        return sum(stream.pop(entry_id, None) is not None for entry_id in entry_ids)
+
+    def pipeline(self, transaction=True):
+        return StubPipeline(self)
+
+
+class AsyncStubPipeline(StubPipeline):
+    async def execute(self):
+        return super().execute()
+
+
+class AsyncStubRedis:
+    """Awaitable access to a StubRedis, like redis.asyncio's client."""
+
+    def __init__(self, redis):
+        self.redis = redis
+
+    def __getattr__(self, name):
+        async def call(*args, **kwargs):
+            return getattr(self.redis, name)(*args, **kwargs)
+
+        return call
+
+    def pipeline(self, transaction=True):
+        return AsyncStubPipeline(self.redis)
+
+    async def close(self):
+        pass
+
+
+def make_transport(redis):
+    transport = RedisStreamsTransport("test", {})
+    transport.redis = redis
+    return transport
+
+
+def values(events):
+    return [(kind, value) for kind, value in events]
+
+
+#############################################################################
+# Tests
+#############################################################################
+
+
+class TestRedisStreamsTransport:
+    def setup_method(self):
+        self.redis = StubRedis()
+        self.transport = make_transport(self.redis)
+
+    def test_read_args_replaying(self):
+        args = self.transport.read_args(10, None)
+        assert args["streams"] == {
+            self.transport.tick_key: "0",
+            self.transport.incoming_key: "0",
+        }
+        assert args["count"] == 10
+        # Pending entries are all there already, so there's nothing to wait for
+        assert args["block"] is None
+
+    def test_read_args_block(self):
+        self.transport.replay_ids = None
+
+        def block(timeout):
+            return self.transport.read_args(1, timeout)["block"]
+
+        assert self.transport.read_args(1, None)["streams"] == {
+            self.transport.tick_key: ">",
+            self.transport.incoming_key: ">",
+        }
+        assert block(None) == 0
+        assert block(0) is None
+        assert block(0.5) == 500
+        # BLOCK 0 would wait forever
+        assert block(0.0001) == 1
+
+    def test_parse(self):
+        tick_key = self.transport.tick_key.encode("utf-8")
+        incoming_key = self.transport.incoming_key.encode("utf-8")
+
+        events, deleted = self.transport.parse(
+            [
+                [tick_key, [(b"1500-0", {b"data": b"1.0"})]],
+                [
+                    incoming_key,
+                    [(b"2000-0", {b"data": b"1 look"}), (b"2500-1", {})],
+                ],
+            ]
+        )
+
+        assert values(events) == [(TICK, "1.0"), (COMMAND, "1 look")]
+        assert [event.id for event in events] == [
+            (self.transport.tick_key, b"1500-0"),
+            (self.transport.incoming_key, b"2000-0"),
+        ]
+        assert [event.queued_at for event in events] == [1.5, 2.0]
+        assert deleted == [(self.transport.incoming_key, b"2500-1")]
+
+        # Replaying carries on from the last pending entry of each stream
+        assert self.transport.replay_ids == {
+            self.transport.tick_key: b"1500-0",
+            self.transport.incoming_key: b"2500-1",
+        }
+
+        # Until there are none left
+        assert self.transport.parse([[tick_key, []], [incoming_key, []]]) == ([], [])
+        assert not self.transport.replaying
+
+    def test_clock_offset(self):
+        self.redis.skew = 100
+        self.transport.ensure_groups()
+        assert self.transport.clock_offset == pytest.approx(100, abs=0.01)
+
+        self.transport.replay_ids = None
+        tick_key = self.transport.tick_key.encode("utf-8")
+        events, _ = self.transport.parse(
+            [[tick_key, [(b"101500-0", {b"data": b"1.0"})]]]
+        )
+        assert events[0].queued_at == pytest.approx(1.5, abs=0.01)
+
+        self.redis.skew = -5
+        self.transport.backlog()
+        assert self.transport.clock_offset == pytest.approx(-5, abs=0.01)
+
+    def test_parse_nothing(self):
+        self.transport.replay_ids = None
+        assert self.transport.parse(None) == ([], [])
+
+    def test_receive_and_ack(self):
+        self.transport.clear_ticks()
+        self.transport.enqueue_command(1, "look")
+        self.transport.enqueue_command(1, "north")
+        self.transport.push_tick("1.0")
+
+        events = self.transport.receive(10, 0)
+        assert values(events) == [
+            (TICK, "1.0"),
+            (COMMAND, "1 look"),
+            (COMMAND, "1 north"),
+        ]
+        assert self.transport.receive(10, 0) == []
+        assert self.transport.backlog() == 2
+
+        self.transport.ack(events)
+        assert self.transport.backlog() == 0
+        assert not any(group["pending"] for group in self.redis.groups.values())
+
+    def test_receive_count(self):
+        for command in ("one", "two", "three"):
+            self.transport.enqueue_command(1, command)
+
+        assert values(self.transport.receive(2, 0)) == [
+            (COMMAND, "1 one"),
+            (COMMAND, "1 two"),
+        ]
+        assert values(self.transport.receive(2, 0)) == [(COMMAND, "1 three")]
+
+    def test_stale_ticks_skipped(self):
+        self.transport.push_tick("1.0")
+        self.transport.enqueue_command(1, "look")
+
+        assert values(self.transport.receive(10, 0)) == [(COMMAND, "1 look")]
+
+    def test_requeue(self):
+        self.transport.enqueue_command(1, "one")
+        self.transport.enqueue_command(1, "two")
+
+        events = self.transport.receive(10, 0)
+        self.transport.requeue(events[1:])
+        assert self.transport.receive(10, 0) == events[1:]
+
+    def test_replay_pending(self):
+        self.transport.enqueue_command(1, "one")
+        self.transport.enqueue_command(1, "two")
+        self.transport.enqueue_command(1, "three")
+        events = self.transport.receive(10, 0)
+        self.transport.ack(events[:1])
+
+        # The zone crashes before acknowledging the rest
+        self.transport.enqueue_command(1, "four")
+        restarted = make_transport(self.redis)
+        self.redis.reads = []
+
+        assert values(restarted.receive(1, None)) == [(COMMAND, "1 two")]
+        assert values(restarted.receive(10, None)) == [(COMMAND, "1 three")]
+        assert values(restarted.receive(10, None)) == [(COMMAND, "1 four")]
+
+        # Replays never block, and the first read after them waits as asked
+        assert [block for _, block in self.redis.reads] == [None, None, None, 0]
+        assert not restarted.replaying
+
+    def test_replay_skips_deleted(self):
+        self.transport.enqueue_command(1, "one")
+        self.transport.enqueue_command(1, "two")
+        events = self.transport.receive(10, 0)
+
+        # Trimmed away while still pending
+        self.redis.xdel(self.transport.incoming_key, events[0].id[1])
+
+        restarted = make_transport(self.redis)
+        assert values(restarted.receive(10, 0)) == [(COMMAND, "1 two")]
+
+        group = self.redis.groups[self.transport.incoming_key, self.transport.group]
+        assert list(group["pending"]) == [events[1].id[1]]
+
+    def test_drain_ticks(self):
+        self.transport.clear_ticks()
+        self.transport.replay_ids = None
+        self.transport.push_tick("1.0")
+        self.transport.enqueue_command(1, "look")
+        self.transport.push_tick("2.0")
+
+        events = self.transport.receive(1, 0)
+        assert values(events) == [(TICK, "1.0")]
+        assert values(self.transport.drain_ticks()) == [(TICK, "2.0")]
+        assert values(self.transport.receive(10, 0)) == [(COMMAND, "1 look")]
+
+    def test_drain_ticks_replaying(self):
+        self.transport.clear_ticks()
+        self.transport.push_tick("1.0")
+        self.transport.push_tick("2.0")
+        self.transport.enqueue_command(1, "look")
+        self.transport.receive(10, 0)
+
+        restarted = make_transport(self.redis)
+        restarted.push_tick("3.0")
+        events = restarted.receive(10, 0)
+        assert values(events) == [(TICK, "1.0"), (TICK, "2.0"), (COMMAND, "1 look")]
+        restarted.requeue(events[1:])
+
+        # Only ticks already pending; new ones wait for the replay to finish
+        assert values(restarted.drain_ticks()) == [(TICK, "2.0")]
+        assert values(restarted.receive(10, 0)) == [(COMMAND, "1 look")]
+        assert values(restarted.receive(10, 0)) == [(TICK, "3.0")]
+
+
+class TestAsyncRedisStreamsTransport:
+    def setup_method(self):
+        self.redis = StubRedis()
+        self.transport = make_transport(self.redis)
+
+    def aio(self, transport):
+        atransport = AsyncRedisStreamsTransport(transport)
+        atransport.redis = AsyncStubRedis(self.redis)
+        return atransport
+
+    def test_replay_pending(self):
+        self.transport.enqueue_command(1, "one")
+        self.transport.enqueue_command(1, "two")
+        self.transport.receive(10, 0)
+
+        restarted = make_transport(self.redis)
+        restarted.enqueue_command(1, "three")
+
+        async def run():
+            atransport = self.aio(restarted)
+            replayed = await atransport.receive(10)
+            await atransport.ack(replayed)
+            await atransport.push_tick("1.0")
+            events = await atransport.receive(10)
+            await atransport.ack(events)
+            return replayed, events, await atransport.backlog()
+
+        replayed, events, backlog = asyncio.run(run())
+        assert values(replayed) == [(COMMAND, "1 one"), (COMMAND, "1 two")]
+        assert values(events) == [(TICK, "1.0"), (COMMAND, "1 three")]
+        assert backlog == 0
+
+    def test_drain_ticks(self):
+        async def run():
+            atransport = self.aio(self.transport)
+            await atransport.clear_ticks()
+            self.transport.replay_ids = None
+            await atransport.push_tick("1.0")
+            await atransport.push_tick("2.0")
+            events = await atransport.receive(1)
+            return events + await atransport.drain_ticks()
+
+        assert values(asyncio.run(run())) == [(TICK, "1.0"), (TICK, "2.0")]
@@ -0,0 +1,1191 @@
+import json
+import os
+import asyncio
+import random
+import re
+import threading
+import time
+
+import pytest
+
+from figment import Zone, Entity, Component, Mode
+from figment.aio import AsyncZone, ThreadedAsyncTransport
+from figment.zone import configure
+from figment.transport import MemoryTransport, RedisTransport, Event, TICK, COMMAND
+from figment.ticker import TickClock, format_tick, parse_tick
+from figment.timers import TimerWheel
+from figment.overload import OverloadController
+from figment.fairness import FairQueue
+from figment.actions import Wait
+from figment.watchdog import Watchdog
+from figment.journal import Journal
+from figment import snapshots
+from figment.serializers import JSONSerializer, BinarySerializer
+
+#############################################################################
+# Components and modes
+#############################################################################
+
+
+class Counting(Component):
+    """Counts the ticks it has seen."""
+
+    ticking = True
+
+    def __init__(self, ticks=0, elapsed=0):
+        self.ticks = ticks
+        self.elapsed = elapsed
+
+    def to_dict(self):
+        return {"ticks": self.ticks, "elapsed": self.elapsed}
+
+    def tick(self, dt):
+        self.ticks += 1
+        self.elapsed += dt
+
+
+class Calf(Counting):
+    """Counts the ticks it has seen, as a class of its own."""
+
+
+class Idle(Counting):
+    """Counts the ticks it has seen, when the zone can spare them."""
+
+    sheddable = True
+
+
+class Slow(Counting):
+    """Counts the ticks it has seen, but only ticks every third zone tick."""
+
+    tick_every = 3
+
+
+class Restless(Component):
+    """Counts the ticks it acts on, given some chance of acting."""
+
+    ticking = True
+
+    def __init__(self, tick_chance, acted=0, elapsed=0):
+        self.tick_chance = tick_chance
+        self.acted = acted
+        self.elapsed = elapsed
+
+    def to_dict(self):
+        return {
+            "tick_chance": self.tick_chance,
+            "acted": self.acted,
+            "elapsed": self.elapsed,
+        }
+
+    def act(self, dt):
+        self.acted += 1
+        self.elapsed += dt
+
+
+class Sluggish(Restless):
+    """Counts the ticks it acts on, but only gets a chance every other tick."""
+
+    tick_every = 2
+
+
+class Label(Component):
+    """Some text to remember."""
+
+    def __init__(self, text):
+        self.text = text
+
+    def to_dict(self):
+        return {"text": self.text}
+
+
+class Pointer(Component):
+    """Refers to another entity."""
+
+    def __init__(self, target_id):
+        self.target_id = target_id
+        self.target = None
+
+    def to_dict(self):
+        return {"target_id": self.target_id}
+
+    def attach(self, entity):
+        super().attach(entity)
+        self.target = entity.zone.get(self.target_id)
+
+
+class Bomb(Component):
+    """Explodes some time after being armed."""
+
+    def __init__(self):
+        self.exploded = False
+
+    def arm(self, delay):
+        return self.schedule_in(delay, "explode", "BOOM")
+
+    def explode(self, sound):
+        self.exploded = sound
+
+
+BANGS = []
+
+
+def bang(sound):
+    BANGS.append(sound)
+
+
+def countdown(actor, count):
+    while count:
+        actor.zone.send_message(actor.id, json.dumps(count))
+        count -= 1
+        yield Wait(1, count=count)
+    actor.zone.send_message(actor.id, json.dumps("Liftoff!"))
+
+
+def hum(actor, times):
+    for _ in range(times):
+        actor.zone.send_message(actor.id, json.dumps("hum"))
+        yield
+
+
+def dawdle(seconds):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        pass
+
+
+class DawdleMode(Mode):
+    """Takes its time over every command."""
+
+    def perform(self, entity, command):
+        dawdle(0.05)
+
+
+class JotMode(Mode):
+    """Takes its time over every command, then repeats it back once."""
+
+    def perform(self, entity, command):
+        dawdle(0.01)
+        entity.zone.send_message(entity.id, json.dumps(command))
+
+
+class ShoutMode(Mode):
+    """Repeats every command back to the entity twice."""
+
+    def perform(self, entity, command):
+        for _ in range(2):
+            entity.zone.send_message(entity.id, json.dumps(command))
+
+
+class RollMode(Mode):
+    """Labels the entity with each command and a random number."""
+
+    def perform(self, entity, command):
+        entity.Label.text = "%s %s" % (command, random.random())
+        entity.zone.send_message(entity.id, json.dumps(entity.Label.text))
+
+
+def make_zone(cls=Zone, **kwargs):
+    zone = cls()
+    zone.id = "test"
+    zone.transport = MemoryTransport(zone.id, {})
+    for name, value in kwargs.items():
+        setattr(zone, name, value)
+    return zone
+
+
+def snapshot_zone(path, cls=Zone, **persistence):
+    zone = make_zone(cls)
+    zone.config = {
+        "persistence": dict({"mode": "snapshot", "file": str(path)}, **persistence)
+    }
+    zone.components = {"Label": Label, "Counting": Counting, "Pointer": Pointer}
+    zone.modes = {"ShoutMode": ShoutMode, "RollMode": RollMode}
+    if zone.config["persistence"]["mode"] == "journal":
+        zone.journal = Journal(zone.journal_path)
+    zone.incremental_snapshots = persistence.get("incremental", False)
+    zone.compact_every = persistence.get("compact_every", 10)
+    return zone
+
+
+def save(zone, **kwargs):
+    zone.save_snapshot(**kwargs)
+    assert zone.reap_snapshot(block=True)
+
+
+def received(subscription):
+    messages = []
+    while True:
+        message = subscription.get_message()
+        if message is None:
+            return messages
+        messages.append(json.loads(message))
+
+
+class TestZone:
+    def setup_method(self):
+        self.zone = make_zone(batch_size=10)
+        self.player = self.zone.spawn(mode=ShoutMode())
+        self.cow = self.zone.spawn([Counting()])
+        self.subscription = self.zone.subscribe(self.player.id)
+
+    def test_receive_prefers_ticks(self):
+        self.zone.enqueue_command(self.player.id, "one")
+        self.zone.enqueue_command(self.player.id, "two")
+        self.zone.transport.push_tick(1)
+
+        events = self.zone.receive_events()
+        assert [kind for kind, _ in events] == [TICK, COMMAND, COMMAND]
+
+    def test_batch(self):
+        for command in ("one", "two", "three"):
+            self.zone.enqueue_command(self.player.id, command)
+
+        self.zone.process_one_event()
+        assert received(self.subscription) == ["one"] * 2 + ["two"] * 2 + ["three"] * 2
+
+    def test_batch_time_requeues(self):
+        self.zone.batch_time = 1e-9
+        self.zone.enqueue_command(self.player.id, "one")
+        self.zone.enqueue_command(self.player.id, "two")
+
+        self.zone.process_one_event()
+        assert received(self.subscription) == ["one", "one"]
+
+        self.zone.process_one_event()
+        assert received(self.subscription) == ["two", "two"]
+
+    def test_merge_messages(self):
+        self.zone.merge_messages = True
+        self.zone.enqueue_command(self.player.id, "moo")
+
+        self.zone.process_one_event()
+        messages = received(self.subscription)
+        assert len(messages) == 1
+        assert self.zone.unmerge(messages[0]) == ["moo", "moo"]
+
+    def test_tick(self):
+        self.zone.transport.push_tick(1)
+        self.zone.process_one_event()
+        assert self.cow.Counting.ticks == 1
+        assert self.zone.stats["ticks"] == 1
+
+    def test_tick_dt(self):
+        self.zone.batch_size = 1
+        self.zone.coalesce_ticks = False
+        self.zone.transport.push_tick(format_tick(3, 0.5))
+        self.zone.transport.push_tick(format_tick(6, 2.0))
+        self.zone.process_one_event()
+        self.zone.process_one_event()
+        assert self.cow.Counting.ticks == 2
+        assert self.cow.Counting.elapsed == 2.5
+        assert self.zone.stats["ticks_skipped"] == 2
+
+    def test_tick_jitter(self):
+        bomb = self.zone.spawn([Bomb()])
+        bomb.Bomb.arm(3)
+        slow = self.zone.spawn([Slow()])
+
+        # A late tick followed by an early one still only makes two
+        self.zone.perform_tick(1.6)
+        self.zone.perform_tick(0.4)
+        assert not bomb.Bomb.exploded
+        assert slow.Slow.ticks == 0
+        assert self.cow.Counting.ticks == 2
+
+        self.zone.perform_tick(1.0)
+        assert bomb.Bomb.exploded
+        assert slow.Slow.ticks == 1
+        assert self.zone.elapsed == 3.0
+
+    def test_coalesce_ticks(self):
+        self.zone.batch_size = 1
+        self.zone.enqueue_command(self.player.id, "moo")
+        for seq in range(5):
+            self.zone.transport.push_tick(format_tick(seq, 0.5))
+
+        self.zone.process_one_event()
+        assert self.cow.Counting.ticks == 1
+        assert self.cow.Counting.elapsed == 2.5
+        assert self.zone.stats["ticks_coalesced"] == 4
+        assert self.zone.tick_seq == 4
+
+        self.zone.process_one_event()
+        assert received(self.subscription) == ["moo", "moo"]
+
+    def test_legacy_tick_dt(self):
+        self.zone.transport.push_tick(1)
+        self.zone.process_one_event()
+        assert self.cow.Counting.elapsed == self.zone.tick_interval
+
+    def test_ticking_index(self):
+        calf = self.zone.spawn([Counting()])
+        assert self.zone.ticking_counts() == {"Counting": 2}
+
+        calf.components.remove(Counting)
+        assert self.zone.ticking_counts() == {"Counting": 1}
+
+        self.zone.destroy(self.cow)
+        assert self.zone.ticking_counts() == {}
+
+    def test_tick_every(self):
+        slow = self.zone.spawn([Slow()]).Slow
+        for _ in range(7):
+            self.zone.perform_tick()
+        assert self.cow.Counting.ticks == 7
+        assert slow.ticks == 2
+        assert slow.elapsed == self.zone.tick_interval * 6
+
+    def test_tick_every_coalesced(self):
+        slow = self.zone.spawn([Slow()]).Slow
+        self.zone.perform_tick(dt=self.zone.tick_interval * 4)
+        assert slow.ticks == 1
+        assert slow.elapsed == self.zone.tick_interval * 4
+
+        self.zone.destroy(slow.entity)
+        assert self.zone.tick_buckets[3].classes == {}
+
+    def test_tick_phases(self):
+        self.zone.tick_phases = 2
+        herd = [self.cow] + [self.zone.spawn([Counting()]) for _ in range(3)]
+
+        self.zone.perform_tick()
+        assert sum(cow.Counting.ticks for cow in herd) == 2
+
+        self.zone.enqueue_command(self.player.id, "moo")
+        self.zone.process_one_event()
+        assert received(self.subscription) == ["moo", "moo"]
+        assert [cow.Counting.ticks for cow in herd] == [1, 1, 1, 1]
+
+    def test_tick_phases_idle(self):
+        self.zone.tick_phases = 2
+        self.zone.tick_interval = 0.01
+        calf = self.zone.spawn([Counting()])
+
+        self.zone.perform_tick()
+        assert self.cow.Counting.ticks + calf.Counting.ticks == 1
+        self.zone.process_one_event()
+        assert self.cow.Counting.ticks + calf.Counting.ticks == 2
+
+    def test_tick_phases_finish_before_next_tick(self):
+        self.zone.tick_phases = 3
+        self.zone.perform_tick()
+        self.zone.perform_tick()
+        assert self.cow.Counting.ticks == 2
+        assert len(self.zone.pending_phases) == 2
+
+    def test_phase_budget(self):
+        self.zone.tick_phases = 2
+        self.zone.phase_budget = 1e-9
+        calf = self.zone.spawn([Calf()]).Calf
+        self.zone.perform_tick()
+        assert (self.cow.Counting.ticks, calf.ticks) == (1, 0)
+        assert self.zone.stats["phases_overrun"] == 1
+
+        self.zone.run_phase()
+        assert calf.ticks == 1
+
+    def test_overload(self, monkeypatch):
+        told = []
+        monkeypatch.setattr(
+            Entity, "tell", lambda entity, message: told.append(message)
+        )
+        self.zone.overload = OverloadController(backlog=2, commands_per_entity=1)
+        idle = self.zone.spawn([Idle()]).Idle
+        for _ in range(3):
+            self.zone.enqueue_command(self.player.id, "moo")
+
+        self.zone.housekeeping()
+        assert self.zone.overload.level == 1
+        assert self.zone.stats["overload_level"] == 1
+
+        self.zone.process_one_event()
+        assert received(self.subscription) == ["moo", "moo"]
+        assert len(told) == 2
+        assert self.zone.stats["commands_shed"] == 2
+
+        self.zone.perform_tick()
+        self.zone.perform_tick()
+        assert self.cow.Counting.ticks == 1
+        assert self.cow.Counting.elapsed == self.zone.tick_interval * 2
+        assert idle.ticks == 0
+
+    def test_overload_lag(self):
+        self.zone.overload = OverloadController(lag_ms=50)
+        self.zone.enqueue_command(self.player.id, "moo")
+        time.sleep(0.1)
+
+        self.zone.process_one_event()
+        assert self.zone.stats["lag_ms"] >= 100
+        self.zone.housekeeping()
+        assert self.zone.overload.level == 1
+
+    def test_overload_recovery(self):
+        overload = OverloadController(lag_ms=100, recovery_checks=2)
+        assert overload.check(0, 500) == 1
+        assert overload.check(0, 500) == 2
+        assert overload.check(0, 80) == 2
+        assert overload.check(0, 10) == 2
+        assert overload.check(0, 10) == 1
+        assert overload.check(0, 10) == 1
+        assert overload.check(0, 10) == 0
+
+    def test_fair_commands(self):
+        self.zone.batch_size = 2
+        self.zone.command_queue = FairQueue()
+        other = self.zone.spawn(mode=ShoutMode())
+        others = self.zone.subscribe(other.id)
+        for command in ("one", "two", "three"):
+            self.zone.enqueue_command(self.player.id, command)
+        self.zone.enqueue_command(other.id, "hi")
+
+        self.zone.process_one_event()
+        assert received(self.subscription) == ["one", "one"]
+        assert received(others) == ["hi", "hi"]
+
+        self.zone.process_one_event()
+        assert received(self.subscription) == ["two"] * 2 + ["three"] * 2
+
+    def test_fair_commands_overflow(self, monkeypatch):
+        told = []
+        monkeypatch.setattr(
+            Entity, "tell", lambda entity, message: told.append(message)
+        )
+        self.zone.command_queue = FairQueue(queue_limit=2)
+        self.zone.batch_size = 3
+        for command in ("one", "two", "three"):
+            self.zone.enqueue_command(self.player.id, command)
+
+        self.zone.process_one_event()
+        assert received(self.subscription) == ["one"] * 2 + ["two"] * 2
+        assert len(told) == 1
+        assert self.zone.stats["commands_shed"] == 1
+
+    def test_fair_commands_requeue(self):
+        self.zone.command_queue = FairQueue()
+        self.zone.batch_time = 1e-9
+        self.zone.enqueue_command(self.player.id, "one")
+        self.zone.enqueue_command(self.player.id, "two")
+
+        self.zone.process_one_event()
+        assert received(self.subscription) == ["one", "one"]
+        assert len(self.zone.command_queue) == 1
+
+        self.zone.process_one_event()
+        assert received(self.subscription) == ["two", "two"]
+
+    def test_fair_commands_window(self):
+        self.zone.command_queue = FairQueue(window=64, rate=1)
+        self.zone.tick_interval = 0.001
+        for n in range(2000):
+            self.zone.enqueue_command(self.player.id, str(n))
+
+        for _ in range(40):
+            self.zone.process_one_event()
+        assert len(self.zone.command_queue) <= 64
+        assert self.zone.transport.backlog() >= 2000 - 64 - 40
+
+        # Ticks still get through
+        self.zone.transport.push_tick(format_tick(None, 0.001))
+        self.zone.process_one_event()
+        assert self.cow.Counting.ticks == 1
+
+    def test_action(self):
+        self.zone.perform_action(countdown, self.player, count=2)
+        assert received(self.subscription) == [2]
+
+        self.zone.perform_tick()
+        assert received(self.subscription) == [1]
+
+        self.zone.perform_tick()
+        assert received(self.subscription) == ["Liftoff!"]
+        assert len(self.zone.action_timers) == 0
+
+    def test_action_yield(self):
+        self.zone.perform_action(hum, self.player, times=2)
+        assert received(self.subscription) == ["hum"]
+
+        self.zone.process_one_event()
+        assert received(self.subscription) == ["hum"]
+        self.zone.process_one_event()
+        assert not self.zone.ready_actions
+
+    def test_action_restored(self):
+        self.zone.perform_action(countdown, self.player, count=3)
+        self.zone.perform_tick()
+        received(self.subscription)
+
+        saved = json.loads(json.dumps(self.zone.actions_to_list()))
+        assert saved[0]["kwargs"] == {"count": 1}
+        self.zone.action_timers = TimerWheel()
+        self.zone.load_actions(saved)
+
+        self.zone.perform_tick()
+        self.zone.perform_tick()
+        assert received(self.subscription) == [1, "Liftoff!"]
+
+    def test_action_destroyed(self):
+        self.zone.perform_action(countdown, self.player, count=2)
+        self.zone.destroy(self.player)
+        self.zone.perform_tick()
+        assert received(self.subscription) == [2]
+
+    def test_action_lambda(self):
+        with pytest.raises(ValueError):
+            self.zone.perform_action(lambda actor: (yield), self.player)
+
+    def test_watchdog(self):
+        self.zone.watchdog = Watchdog(threshold_ms=5, sample_interval_ms=1)
+        self.zone.watchdog.start()
+        try:
+            slowpoke = self.zone.spawn(mode=DawdleMode())
+            self.zone.enqueue_command(slowpoke.id, "yawn")
+            self.zone.enqueue_command(slowpoke.id, "yawn widely")
+            self.zone.enqueue_command(self.player.id, "moo")
+            self.zone.process_one_event()
+        finally:
+            self.zone.watchdog.stop()
+
+        assert self.zone.stats["slow_events"] == 2
+        # Both commands are totalled together, however they were worded
+        names = {name for name, _ in self.zone.watchdog.hot_stacks}
+        assert names == {"command"}
+        assert all("dawdle" in stack for _, stack in self.zone.watchdog.hot_stacks)
+
+    def test_watchdog_stopped(self, tmp_path):
+        zone = snapshot_zone(tmp_path / "zone.json")
+        zone.watchdog = Watchdog()
+        timer = threading.Timer(0.1, zone.stop)
+        timer.start()
+        zone.start()
+        timer.join()
+
+        assert not zone.watchdog.running
+        assert zone.watchdog.thread is None
+
+    def test_schedule(self):
+        bomb = self.zone.spawn([Bomb()])
+        bomb.Bomb.arm(3)
+
+        self.zone.perform_tick()
+        self.zone.perform_tick()
+        assert not bomb.Bomb.exploded
+
+        self.zone.perform_tick()
+        assert bomb.Bomb.exploded == "BOOM"
+
+    def test_schedule_coalesced_tick(self):
+        bomb = self.zone.spawn([Bomb()])
+        bomb.Bomb.arm(3)
+        self.zone.perform_tick(dt=5)
+        assert bomb.Bomb.exploded == "BOOM"
+
+    def test_schedule_cancel(self):
+        bomb = self.zone.spawn([Bomb()])
+        bomb.Bomb.arm(1).cancel()
+        self.zone.perform_tick()
+        assert not bomb.Bomb.exploded
+
+    def test_schedule_destroyed(self):
+        bomb = self.zone.spawn([Bomb()])
+        bomb.Bomb.arm(1)
+        self.zone.destroy(bomb)
+        self.zone.perform_tick()
+
+    def test_schedule_function(self):
+        self.zone.schedule(1, bang, "bang")
+        self.zone.perform_tick()
+        assert BANGS == ["bang"]
+
+    def test_schedule_lambda(self):
+        with pytest.raises(ValueError):
+            self.zone.schedule(1, lambda: None)
+
+    def test_sampled_ticks(self):
+        self.zone.sampled_ticks = True
+        sure = self.zone.spawn([Restless(1)])
+        never = self.zone.spawn([Restless(0)])
+        coin = self.zone.spawn([Restless(0.5)])
+        assert self.zone.ticking_counts() == {"Counting": 1, "Restless": 3}
+        assert "Restless" not in {cls.__name__ for cls in self.zone.ticking_components}
+
+        for _ in range(1000):
+            self.zone.perform_tick()
+        assert sure.Restless.acted == 1000
+        assert never.Restless.acted == 0
+        assert 400 < coin.Restless.acted < 600
+
+    def test_sampled_ticks_untracked(self):
+        self.zone.sampled_ticks = True
+        restless = Restless(1)
+        sure = self.zone.spawn([restless])
+        self.zone.perform_tick()
+        sure.components.remove(Restless)
+        self.zone.perform_tick()
+        assert restless.acted == 1
+        assert self.zone.ticking_counts() == {"Counting": 1}
+
+    def test_sampled_ticks_coalesced(self):
+        self.zone.sampled_ticks = True
+        sure = self.zone.spawn([Restless(1)])
+        self.zone.perform_tick(dt=self.zone.tick_interval * 5)
+        assert sure.Restless.acted == 1
+        assert self.zone.sampler.now == 5
+
+    def test_sampled_ticks_retuned(self):
+        self.zone.sampled_ticks = True
+        never = self.zone.spawn([Restless(0)])
+        self.zone.perform_tick()
+        assert never.Restless.acted == 0
+
+        never.Restless.tick_chance = 1
+        self.zone.perform_tick()
+        assert never.Restless.acted == 1
+
+    def test_sampled_ticks_period(self):
+        self.zone.sampled_ticks = True
+        sure = self.zone.spawn([Sluggish(1)])
+        for _ in range(4):
+            self.zone.perform_tick()
+        assert sure.Sluggish.acted == 2
+        assert sure.Sluggish.elapsed == 4 * self.zone.tick_interval
+
+    def test_catch_up_period(self, monkeypatch):
+        coin = self.zone.spawn([Sluggish(0.5)])
+        self.zone.suspend(coin.Sluggish)
+        self.zone.perform_tick()
+        self.zone.perform_tick()
+
+        # Two zone ticks make one missed period, with a 50% chance to act
+        monkeypatch.setattr(random, "random", lambda: 0.6)
+        self.zone.resume(coin.Sluggish)
+        assert coin.Sluggish.acted == 0
+
+    def test_unsampled_chance(self):
+        coin = self.zone.spawn([Restless(1)])
+        self.zone.perform_tick()
+        assert coin.Restless.acted == 1
+
+    def test_suspend(self):
+        self.zone.suspend(self.cow.Counting)
+        self.zone.perform_tick(dt=self.zone.tick_interval)
+        self.zone.perform_tick(dt=self.zone.tick_interval)
+        assert self.cow.Counting.ticks == 0
+        assert self.zone.ticking_counts() == {}
+
+        self.zone.resume(self.cow.Counting)
+        assert self.cow.Counting.ticks == 1
+        assert self.cow.Counting.elapsed == self.zone.tick_interval * 2
+
+        self.zone.perform_tick()
+        assert self.cow.Counting.ticks == 2
+
+    def test_suspend_destroyed(self):
+        counting = self.cow.Counting
+        self.zone.suspend(counting)
+        self.zone.destroy(self.cow)
+        assert self.zone.suspended == {}
+
+    def test_dormant_entity(self):
+        self.zone.set_dormant(self.cow, True)
+        assert self.cow.Counting in self.zone.suspended
+
+        # Ticking components added while it's dormant don't start ticking
+        self.cow.components.add(Restless(1))
+        assert self.cow.Restless in self.zone.suspended
+        self.zone.perform_tick()
+        assert self.zone.ticking_counts() == {}
+
+        self.zone.set_dormant(self.cow, False)
+        assert self.zone.suspended == {}
+        assert self.cow.Counting.ticks == 1
+
+    def test_suspend_sampled(self):
+        self.zone.sampled_ticks = True
+        restless = self.zone.spawn([Restless(1)]).Restless
+        self.zone.suspend(restless)
+        self.zone.perform_tick()
+        assert restless.acted == 0
+
+        self.zone.resume(restless)
+        self.zone.perform_tick()
+        assert restless.acted == 2
+
+    def test_receive_timeout(self):
+        assert self.zone.transport.receive(timeout=0.01) == []
+
+
+def async_zone(zone):
+    zone.tick_interval = 0.01
+    zone.housekeeping_interval = 0.01
+    zone.atransport = zone.transport.aio()
+    zone.atransport.poll_interval = 0.01
+    return zone
+
+
+def run_async(zone, seconds=0.2):
+    async def run():
+        asyncio.get_running_loop().call_later(seconds, zone.stop)
+        await zone.run()
+
+    asyncio.run(run())
+
+
+class TestAsyncZone:
+    def setup_method(self):
+        self.zone = async_zone(make_zone(AsyncZone, batch_size=10))
+        self.player = self.zone.spawn(mode=ShoutMode())
+        self.cow = self.zone.spawn([Counting()])
+        self.subscription = self.zone.subscribe(self.player.id)
+
+    def test_threaded_transport(self):
+        assert isinstance(self.zone.atransport, ThreadedAsyncTransport)
+
+    def test_run(self):
+        self.zone.enqueue_command(self.player.id, "one")
+        self.zone.enqueue_command(self.player.id, "two")
+
+        run_async(self.zone)
+        assert not self.zone.running
+        assert received(self.subscription) == ["one"] * 2 + ["two"] * 2
+        assert self.cow.Counting.ticks > 0
+        assert self.zone.transport.backlog() == 0
+
+    def test_stop_loses_nothing(self):
+        commands = [str(n) for n in range(30)]
+
+        for seconds in (0.02, 0.05, 0.08, 0.11, 0.14):
+            zone = async_zone(make_zone(AsyncZone, batch_size=4))
+            player = zone.spawn(mode=JotMode())
+            subscription = zone.subscribe(player.id)
+            for command in commands:
+                zone.enqueue_command(player.id, command)
+
+            run_async(zone, seconds)
+            processed = received(subscription)
+            requeued = [
+                value.partition(" ")[2]
+                for kind, value in zone.transport.receive(100, 0)
+                if kind == COMMAND
+            ]
+            assert processed
+            assert processed + requeued == commands
+
+    def test_requeue_unprocessed(self):
+        async def stop():
+            self.zone.inbound = asyncio.Queue()
+            self.zone.leftover = [Event(COMMAND, (self.player.id, "one"))]
+            self.zone.inbound.put_nowait([Event(COMMAND, (self.player.id, "two"))])
+            await self.zone.requeue_unprocessed()
+
+        asyncio.run(stop())
+        assert self.zone.leftover == []
+        events = self.zone.transport.receive(10, 0)
+        assert [value for _, value in events] == [
+            (self.player.id, "one"),
+            (self.player.id, "two"),
+        ]
+
+    def test_transport_off_loop(self):
+        self.zone.overload = OverloadController()
+
+        transport = self.zone.transport
+        loop_thread = threading.current_thread()
+        calls = []
+
+        def recorded(method):
+            def call(*args):
+                calls.append((method.__name__, threading.current_thread()))
+                return method(*args)
+
+            return call
+
+        transport.publish = recorded(transport.publish)
+        transport.backlog = recorded(transport.backlog)
+
+        self.zone.enqueue_command(self.player.id, "one")
+        run_async(self.zone)
+
+        assert received(self.subscription) == ["one"] * 2
+        assert {name for name, _ in calls} == {"publish", "backlog"}
+        assert all(thread is not loop_thread for _, thread in calls)
+
+    def test_start_saves_snapshot(self, tmp_path):
+        zone = async_zone(snapshot_zone(tmp_path / "zone.json", AsyncZone))
+        cow = zone.spawn([Label("moo")])
+
+        timer = threading.Timer(0.2, zone.stop)
+        timer.start()
+        zone.start()
+        timer.join()
+
+        loaded = snapshot_zone(tmp_path / "zone.json")
+        loaded.load_snapshot()
+        assert loaded.get(cow.id).Label.text == "moo"
+
+
+class TestSnapshots:
+    @pytest.fixture(autouse=True)
+    def setup_zone(self, tmp_path):
+        self.path = tmp_path / "zone.json"
+        self.zone = snapshot_zone(self.path, incremental=True, compact_every=2)
+        self.a = self.zone.spawn([Label("a")])
+        self.b = self.zone.spawn([Label("b")], mode=ShoutMode())
+        save(self.zone)
+
+    def load(self):
+        zone = snapshot_zone(self.path)
+        assert zone.load_snapshot()
+        return zone
+
+    def test_dirty_tracking(self):
+        assert not self.zone.dirty
+
+        self.a.Label.text = "A"
+        assert self.zone.dirty == {self.a.id}
+
+        self.b.hearing = True
+        c = self.zone.spawn()
+        self.zone.destroy(self.a)
+        assert self.zone.dirty == {self.b.id, c.id}
+        assert self.zone.destroyed == {self.a.id}
+
+    def test_incremental(self):
+        self.zone.destroy(self.a)
+        self.b.Label.text = "B"
+        c = self.zone.spawn([Label("c"), Counting()])
+        save(self.zone)
+
+        delta = snapshots.read(
+            snapshots.delta_path(str(self.path), 1, 1), self.zone.snapshot_serializer
+        )
+        assert sorted(e["id"] for e in delta["entities"]) == [self.b.id, c.id]
+        assert delta["destroyed"] == [self.a.id]
+        # Only journal replay needs the tick state
+        assert delta["ticking"] is None
+
+        zone = self.load()
+        assert sorted(zone.entities) == [self.b.id, c.id]
+        assert zone.get(self.b.id).Label.text == "B"
+        assert isinstance(zone.get(self.b.id).mode, ShoutMode)
+        assert zone.spawn().id == c.id + 1
+
+    def test_compaction(self):
+        for text in ("one", "two", "three"):
+            self.a.Label.text = text
+            save(self.zone)
+
+        assert self.zone.snapshot_generation == 2
+        assert snapshots.delta_paths(str(self.path)) == []
+        assert self.load().get(self.a.id).Label.text == "three"
+
+    def test_streaming(self):
+        # a refers to an entity that comes after it
+        c = self.zone.spawn([Label("c")])
+        self.a.components.add(Pointer(c.id))
+        save(self.zone, full=True)
+
+        with open(str(self.path)) as f:
+            lines = [json.loads(line) for line in f]
+        assert "entities" not in lines[0]
+        assert [e["id"] for e in lines[1:]] == [self.a.id, self.b.id, c.id]
+
+        zone = self.load()
+        assert zone.get(self.a.id).Pointer.target is zone.get(c.id)
+
+    def test_single_document(self):
+        entities = [e.to_dict() for e in self.zone.all()]
+        with open(str(self.path), "w") as f:
+            json.dump({"entities": entities, "timers": [], "actions": []}, f)
+        for path in snapshots.delta_paths(str(self.path)):
+            os.unlink(path)
+
+        assert sorted(self.load().entities) == [self.a.id, self.b.id]
+
+    def test_binary(self):
+        self.zone.config["persistence"]["format"] = "bin"
+        self.a.Label.text = "A"
+        save(self.zone, full=True)
+        self.zone.destroy(self.b)
+        save(self.zone)
+
+        with open(str(self.path), "rb") as f:
+            assert f.read(3) == BinarySerializer.MAGIC
+
+        zone = snapshot_zone(self.path, format="bin")
+        assert zone.load_snapshot()
+        assert sorted(zone.entities) == [self.a.id]
+        assert zone.get(self.a.id).Label.text == "A"
+
+    @pytest.mark.parametrize("compression", snapshots.COMPRESSIONS)
+    def test_compressed(self, compression):
+        self.zone.config["persistence"]["compressed"] = compression
+        self.a.Label.text = "A"
+        save(self.zone, full=True)
+
+        with open(str(self.path), "rb") as f:
+            assert not f.read().startswith(b"{")
+        assert self.load().get(self.a.id).Label.text == "A"
+
+    def test_periodic(self):
+        self.zone.snapshot_frequency = 0.01
+        self.zone.housekeeping_interval = 0
+        self.zone.housekeeping()
+        assert self.zone.snapshot_child is None
+
+        self.a.Label.text = "A"
+        time.sleep(0.02)
+        self.zone.housekeeping()
+        assert self.zone.snapshot_child is not None
+
+        # Only one snapshot is written at a time
+        self.b.Label.text = "B"
+        self.zone.save_snapshot()
+        assert self.zone.snapshot_deltas == 2
+        assert self.zone.reap_snapshot(block=True)
+        assert self.load().get(self.b.id).Label.text == "B"
+
+    def test_write_time(self, monkeypatch):
+        messages = []
+        monkeypatch.setattr(
+            "figment.zone.log.info", lambda message: messages.append(message)
+        )
+        self.a.Label.text = "A"
+        self.zone.save_snapshot()
+        time.sleep(0.2)
+        assert self.zone.reap_snapshot(block=True)
+
+        written, reaped = map(
+            float,
+            re.search(r"written in (.+)s, reaped after (.+)s", messages[-1]).groups(),
+        )
+        assert written < 0.2 <= reaped
+
+    def test_failure(self, monkeypatch):
+        def fail(path, generation):
+            raise IOError("Disk full")
+
+        self.a.Label.text = "A"
+        self.zone.destroy(self.b)
+        monkeypatch.setattr(self.zone, "write_delta", fail)
+        self.zone.save_snapshot()
+        assert not self.zone.dirty
+        assert self.zone.reap_snapshot(block=True) is False
+
+        assert self.zone.dirty == {self.a.id}
+        assert self.zone.destroyed == {self.b.id}
+        assert self.zone.snapshot_deltas == 0
+
+
+class TestJournal:
+    @pytest.fixture(autouse=True)
+    def setup_zone(self, tmp_path):
+        self.path = tmp_path / "zone.json"
+        self.zone = snapshot_zone(self.path, mode="journal")
+        self.a = self.zone.spawn([Label("a"), Counting()], mode=RollMode())
+        save(self.zone)
+
+    def load(self):
+        zone = snapshot_zone(self.path, mode="journal")
+        assert zone.load_snapshot()
+        return zone
+
+    def run(self):
+        self.zone.process_event(COMMAND, "%s one" % self.a.id)
+        self.zone.process_event(TICK, format_tick(0, 1))
+        self.zone.process_event(COMMAND, "%s two" % self.a.id)
+        self.zone.journal.sync(force=True)
+
+    def test_replay(self):
+        self.run()
+
+        zone = self.load()
+        assert zone.journal.seq == 3
+        assert zone.get(self.a.id).Label.text == self.a.Label.text
+        assert zone.get(self.a.id).Counting.ticks == 1
+
+    def test_unpredictable_seeds(self, tmp_path):
+        other = snapshot_zone(tmp_path / "other.json", mode="journal")
+        b = other.spawn([Label("b"), Counting()], mode=RollMode())
+        assert b.id == self.a.id
+
+        self.run()
+        other.process_event(COMMAND, "%s one" % b.id)
+        assert b.Label.text != self.a.Label.text
+
+        seeds = [seed for _, _, _, seed in self.zone.journal.read()]
+        assert len(seeds) == 3
+        assert None not in seeds
+
+    def test_replay_unseeded(self):
+        # Journaled before records kept their seeds
+        self.zone.journal.open()
+        self.zone.journal.file.write(json.dumps([1, "C", [self.a.id, "one"]]) + "\n")
+        self.zone.journal.sync(force=True)
+
+        zone = self.load()
+        assert zone.journal.seq == 1
+        assert zone.get(self.a.id).Label.text.startswith("one ")
+
+    def test_replay_is_quiet(self):
+        self.run()
+
+        zone = snapshot_zone(self.path, mode="journal")
+        subscription = zone.transport.subscribe(self.a.id)
+        zone.load_snapshot()
+        assert received(subscription) == []
+
+    def test_replay_ticks(self):
+        def configure(zone):
+            zone.components.update(
+                Restless=Restless, Sluggish=Sluggish, Slow=Slow, Calf=Calf
+            )
+            zone.sampled_ticks = True
+            zone.tick_phases = 2
+            # Every phase runs out of time after its first class
+            zone.phase_budget = 1e-9
+            return zone
+
+        def run(zone, dts):
+            for dt in dts:
+                zone.process_event(TICK, format_tick(None, dt))
+                zone.process_event(COMMAND, "%s roll" % self.a.id)
+                if zone.pending_phases:
+                    zone.run_phase()
+
+        def state(zone):
+            return [entity.to_dict() for entity in zone.all()], zone.ticking_to_dict()
+
+        configure(self.zone)
+        for _ in range(4):
+            self.zone.spawn([Restless(0.4), Slow()])
+            self.zone.spawn([Sluggish(0.5), Counting(), Calf()])
+        self.zone.suspend(self.zone.spawn([Counting()]).Counting)
+
+        run(self.zone, [0.7, 1.3, 0.4, 1, 2.2])
+        assert self.zone.pending_phases
+        assert self.zone.stats["phases_overrun"]
+        save(self.zone)
+        run(self.zone, [0.9, 1, 1.6, 0.3, 1, 1])
+        self.zone.journal.sync(force=True)
+
+        zone = configure(snapshot_zone(self.path, mode="journal"))
+        assert zone.load_snapshot()
+        assert state(zone) == state(self.zone)
+
+    def test_snapshot_truncates(self):
+        self.run()
+        save(self.zone)
+        assert self.zone.journal.segments() == []
+
+        self.zone.process_event(COMMAND, "%s three" % self.a.id)
+        self.zone.journal.sync(force=True)
+
+        zone = self.load()
+        assert zone.journal.seq == 4
+        assert zone.get(self.a.id).Label.text.startswith("three ")
+        assert zone.get(self.a.id).Label.text == self.a.Label.text
+
+
+def test_streaming_compression(tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshots, "CHUNK_SIZE", 64)
+    path = str(tmp_path / "snapshot.json")
+    data = {"entities": [{"id": id, "text": str(id) * 10} for id in range(1000)]}
+
+    for compression in snapshots.COMPRESSIONS + (None,):
+        snapshots.write(path, JSONSerializer, data, compression)
+        assert snapshots.read(path, JSONSerializer) == data
+
+
+def test_binary_random_access(tmp_path):
+    path = str(tmp_path / "snapshot.bin")
+    entities = [{"id": id, "text": str(id)} for id in range(1, 100)]
+    snapshots.write(path, BinarySerializer, {"generation": 1, "entities": entities})
+
+    with open(path, "rb") as f:
+        offsets = {id: offset for id, offset, _ in BinarySerializer.scan(f)}
+        assert len(offsets) == 100
+        assert BinarySerializer.read_at(f, offsets[42]) == {"id": 42, "text": "42"}
+        assert BinarySerializer.read_at(f, offsets[-1]) == {"generation": 1}
+
+
+def test_binary_unknown_codec():
+    data = BinarySerializer.serialize({"a": 1})
+    assert BinarySerializer.unserialize(data) == {"a": 1}
+    with pytest.raises(ValueError):
+        BinarySerializer.unserialize(BinarySerializer.MAGIC + b"?" + data[4:])
+
+
+def test_configure():
+    assert configure(OverloadController, None, "overload") is None
+    assert configure(OverloadController, True, "overload").backlog_limit == 500
+    assert configure(OverloadController, {"backlog": 5}, "overload").backlog_limit == 5
+    with pytest.raises(SystemExit):
+        configure(OverloadController, {"backlgo": 5}, "overload")
+
+
+def test_config_formats(tmp_path, monkeypatch):
+    # Only snapshots can be binary, so a config.bin is never read
+    with open(str(tmp_path / "config.bin"), "wb") as f:
+        BinarySerializer.dump({"zones": {"default": {}}}, f)
+
+    messages = []
+    monkeypatch.setattr(
+        "figment.zone.log.critical", lambda message: messages.append(message)
+    )
+    with pytest.raises(SystemExit):
+        Zone.from_config("default", str(tmp_path))
+    assert messages == ["Unable to read config.{json,yaml} from %s" % tmp_path]
+
+
+def test_redis_command_format():
+    transport = RedisTransport("test", {})
+    pushed = []
+    transport.redis = type(
+        "StubRedis", (), {"rpush": lambda self, key, value: pushed.append(value)}
+    )()
+
+    # Zones and clients of different versions share the list
+    transport.enqueue_command(1, "look")
+    assert pushed == ["1 look"]
+
+    before = time.time()
+    event = transport.decode(transport.incoming_key.encode("utf-8"), b"1 look")
+    assert event == (COMMAND, "1 look")
+    assert before <= event.queued_at <= time.time()
+
+
+def test_fair_queue_rate():
+    queue = FairQueue(rate=2, burst=1)
+    for event in ("a1", "a2"):
+        queue.push("a", event)
+    queue.push("b", "b1")
+
+    assert queue.pop(now=0) == "a1"
+    assert queue.pop(now=0) == "b1"
+    assert queue.pop(now=0) is None
+    assert queue.wait_time(now=0) == 0.5
+    assert queue.pop(now=0.5) == "a2"
+    assert queue.wait_time(now=0.5) is None
+
+
+def test_tick_clock():
+    clock = TickClock(0.01)
+    assert parse_tick(clock.next_tick()) == (0, 0.01)
+    assert 0 < clock.delay() <= 0.01
+
+    clock.started -= 0.05
+    seq, dt = parse_tick(clock.next_tick())
+    assert seq == 5
+    assert clock.delay() <= 0.01
+
+
+def test_timer_wheel_round_trip():
+    wheel = TimerWheel()
+    for ticks in (1, 70, 5000, 300000):
+        wheel.schedule(ticks, {"function": "x:y"})
+    wheel.advance(10)
+
+    restored = TimerWheel()
+    restored.load_list(wheel.to_list())
+    assert restored.to_list() == wheel.to_list()
+    assert len(restored.advance(60)) == 1